@@ -14,20 +14,167 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 import json
-import boto3
-from boto3.dynamodb.conditions import Key, Attr
+import hashlib
+import itertools
+from decimal import Decimal
+from collections.abc import Mapping
+from common import apitool
+
+
+def canonical_json(info):
+    return json.dumps(info, sort_keys=True, separators=(',', ':'),
+                      default=_decimal_to_number)
+
+
+def info_digest(info):
+    """Returns a stable digest of the Info of an API member."""
+    if not isinstance(info, str):
+        info = canonical_json(info)
+    return hashlib.sha1(info.encode('utf-8')).hexdigest()
+
+
+def _decimal_to_number(obj):
+    # boto3 returns every number stored in DynamoDB as Decimal.
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    raise TypeError('{} is not JSON serializable'.format(type(obj)))
+
+
+class APIDBError(Exception):
+    """Raised when the APIDB could not be updated."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _decode_info(info):
+    # Info is kept as a JSON string until it is really needed.
+    if isinstance(info, str):
+        return json.loads(info)
+    return info
+
+
+class APIChange:
+    """An added, removed or changed member.
+
+    old_info and new_info are kept as they come from the backend, usually
+    canonical JSON strings, or None if the backend fetches them on demand.
+    old_hidden and new_hidden are None unless the backend knows them
+    without decoding Info.
+    """
+
+    __slots__ = ('doc_id', 'old_info', 'new_info', 'old_hidden', 'new_hidden')
+
+    def __init__(self, doc_id, old_info=None, new_info=None,
+                 old_hidden=None, new_hidden=None):
+        self.doc_id = doc_id
+        self.old_info = old_info
+        self.new_info = new_info
+        self.old_hidden = old_hidden
+        self.new_hidden = new_hidden
+
+
+class _InfoView(Mapping):
+    """Read-only view of the old or new Info of the changed members."""
+
+    def __init__(self, result, side):
+        self._result = result
+        self._side = side
+
+    def __getitem__(self, docId):
+        return self._result.get_info(docId, self._side)
+
+    def __iter__(self):
+        if self._side == 'old':
+            return itertools.chain(self._result.changed, self._result.removed)
+        return itertools.chain(self._result.added, self._result.changed)
+
+    def __len__(self):
+        if self._side == 'old':
+            return len(self._result.changed) + len(self._result.removed)
+        return len(self._result.added) + len(self._result.changed)
 
 
 class APIComparisonResult:
-    def __init__(self):
-        self.old_api = dict()
-        self.new_api = dict()
+    """Result of APIDB.compare().
+
+    Only the members which are added, removed or changed are kept, as
+    APIChange records keyed by interned DocIds. old_api and new_api are
+    views which decode, or fetch through loader(docId, side), the Info of
+    a member only when it is looked up.
+
+    unhashed holds the new Info of unchanged members that are stored in
+    APIDB without a Hash.
+
+    Backends call add_change() for each member and then count_changes().
+    """
+
+    def __init__(self, loader=None):
         self.added = set()
         self.removed = set()
         self.changed = set()
+        self.unhashed = dict()
         self.total_changed_count = 0
         self.hidden_changed_count = 0
+        self.old_api = _InfoView(self, 'old')
+        self.new_api = _InfoView(self, 'new')
+        self._changes = dict()
+        self._loader = loader
+
+    def add_change(self, kind, docId, **kwargs):
+        """Records a member; kind is 'added', 'removed' or 'changed'."""
+        docId = sys.intern(docId)
+        getattr(self, kind).add(docId)
+        self._changes[docId] = APIChange(docId, **kwargs)
+
+    def discard_change(self, docId):
+        """Forgets the record of a member, if any."""
+        for kind in (self.added, self.removed, self.changed):
+            kind.discard(docId)
+        self._changes.pop(docId, None)
+
+    def get_info(self, docId, side):
+        if side == 'old' and docId in self.added or \
+                side == 'new' and docId in self.removed:
+            raise KeyError(docId)
+        change = self._changes[docId]
+        info = getattr(change, side + '_info')
+        if info is None:
+            if self._loader is None:
+                raise KeyError(docId)
+            # Keep it, as the Info of a member is usually read twice.
+            info = self._loader(docId, side)
+            self.set_info(docId, side, info)
+        return _decode_info(info)
+
+    def has_info(self, docId, side):
+        return getattr(self._changes[docId], side + '_info') is not None
+
+    def set_info(self, docId, side, info):
+        setattr(self._changes[docId], side + '_info', info)
+
+    def is_hidden(self, docId, side):
+        hidden = getattr(self._changes[docId], side + '_hidden')
+        if hidden is None:
+            hidden = self.get_info(docId, side)['IsHidden']
+        return bool(hidden)
+
+    def count_changes(self):
+        self.total_changed_count = len(self.added) + \
+            len(self.removed) + len(self.changed)
+        self.hidden_changed_count = 0
+
+        for i in self.added:
+            if self.is_hidden(i, 'new'):
+                self.hidden_changed_count += 1
+        for i in self.removed:
+            if self.is_hidden(i, 'old'):
+                self.hidden_changed_count += 1
+        for i in self.changed:
+            if self.is_hidden(i, 'new') and self.is_hidden(i, 'old'):
+                self.hidden_changed_count += 1
 
     @property
     def public_api_changed(self):
@@ -38,90 +185,102 @@ class APIComparisonResult:
         return self.hidden_changed_count > 0
 
 
+def compare_sets(oldset, newset, loader=None, fetch_old=None):
+    """Compares the old set with the new set of members.
+
+    oldset is a dict of DocId to (Hash, Info) and is consumed: members
+    found in newset are popped from it, and what remains is removed. Info
+    may be None if Hash is given. The missing old Info of the changed and
+    removed members is read with one call of fetch_old(docIds), which
+    yields (DocId, Info), or else by loader when needed.
+    newset is an iterable of (DocId, Hash, Info) and is read only once,
+    keeping the Info of added and changed members only. If a DocId is
+    found more than once in newset, the last one is compared.
+    """
+    ret = APIComparisonResult(loader=loader)
+
+    # The old (Hash, Info) of the members popped from oldset, or None.
+    matched = dict()
+    for docId, new_hash, new_info in newset:
+        if docId in matched:
+            ret.discard_change(docId)
+            ret.unhashed.pop(docId, None)
+            old = matched[docId]
+        else:
+            old = matched[docId] = oldset.pop(docId, None)
+        if old is None:
+            ret.add_change('added', docId, new_info=new_info)
+            continue
+        old_hash, old_info = old
+        if old_hash is None:
+            old_hash = info_digest(old_info)
+            if old_hash == new_hash:
+                ret.unhashed[docId] = new_info
+        if old_hash != new_hash:
+            ret.add_change('changed', docId,
+                           old_info=old_info, new_info=new_info)
+
+    for docId, (old_hash, old_info) in oldset.items():
+        ret.add_change('removed', docId, old_info=old_info)
+
+    if fetch_old is not None:
+        missing = [docId for docId in itertools.chain(ret.changed,
+                                                      ret.removed)
+                   if not ret.has_info(docId, 'old')]
+        for docId, info in fetch_old(missing):
+            ret.set_info(docId, 'old', info)
+
+    ret.count_changes()
+    return ret
+
+
 class APIDB:
+    """Storage of API members of each category (API level).
+
+    The storage backend is chosen by env.apidb_backend: 'dynamodb' for the
+    TizenFX_API_Members table, or 'sqlite' for a local database file at
+    env.apidb_sqlite_path.
+
+    A backend implements:
+      compare(category, newset) -> APIComparisonResult, where newset is an
+        iterable of (DocId, Hash, Info) and Info is canonical JSON.
+      write(category, item_dict, keys) -> (put_count, delete_count), which
+        puts item_dict of DocId to Info and deletes keys.
+    """
+
     def __init__(self, env):
-        db = boto3.resource('dynamodb', region_name='ap-northeast-2')
-        self._table = db.Table('TizenFX_API_Members')
+        backend = getattr(env, 'apidb_backend', None) or 'dynamodb'
+        if backend == 'dynamodb':
+            from common.apidb_dynamodb import DynamoDBBackend
+            self._backend = DynamoDBBackend(env)
+        elif backend == 'sqlite':
+            from common.apidb_sqlite import SQLiteBackend
+            self._backend = SQLiteBackend(env)
+        else:
+            raise APIDBError('Unknown APIDB backend: ' + backend)
 
     def compare(self, category, jsonfile):
-        with open(jsonfile) as newset_file:
-            newset_json = json.load(newset_file)
-
-        kce = Key('Category').eq(category)
-
-        response = self._table.query(
-            IndexName='Category-DocId-index',
-            KeyConditionExpression=kce
-        )
-        oldset_json = response['Items']
-        while 'LastEvaluatedKey' in response:
-            response = self._table.query(
-                IndexName='Category-DocId-index',
-                KeyConditionExpression=kce,
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-            oldset_json.extend(response['Items'])
-
-        return self._compare_json(oldset_json, newset_json)
+        return self._backend.compare(category, _read_members(jsonfile))
 
     def put_items(self, category, item_dict):
-        for docId in item_dict:
-            print('[PUT] ' + docId)
-            self._table.put_item(
-                Item={
-                    'DocId': docId,
-                    'Category': category,
-                    'Info': item_dict[docId]
-                }
-            )
+        return self._backend.write(category, item_dict, ())
 
     def delete_items(self, category, keys):
-        for docId in keys:
-            print('[DELETE] ' + docId)
-            self._table.delete_item(
-                Key={
-                    'DocId': docId,
-                    'Category': category
-                }
-            )
+        return self._backend.write(category, {}, keys)
 
     def import_datafile(self, category, jsonfile):
         ret = self.compare(category, jsonfile)
-        added_dict = {docId: ret.new_api[docId] for docId in ret.added}
-        changed_dict = {docId: ret.new_api[docId] for docId in ret.changed}
-        self.put_items(category, added_dict)
-        self.put_items(category, changed_dict)
-        self.delete_items(category, ret.removed)
-
-    def _compare_json(self, old_json, new_json):
-        ret = APIComparisonResult()
-
-        for i in old_json:
-            ret.old_api[i['DocId']] = i['Info']
-        for i in new_json:
-            ret.new_api[i['DocId']] = i['Info']
-
-        inter_set = set(ret.old_api.keys()).intersection(ret.new_api.keys())
-        ret.added = set(ret.new_api.keys()).difference(inter_set)
-        ret.removed = set(ret.old_api.keys()).difference(inter_set)
-
-        for i in inter_set:
-            oldinfo = json.dumps(ret.old_api[i], sort_keys=True)
-            newinfo = json.dumps(ret.new_api[i], sort_keys=True)
-            if oldinfo != newinfo:
-                ret.changed.add(i)
-
-        ret.total_changed_count += len(ret.added) + \
-            len(ret.removed) + len(ret.changed)
-
-        for i in ret.added:
-            if ret.new_api[i]['IsHidden']:
-                ret.hidden_changed_count += 1
-        for i in ret.removed:
-            if ret.old_api[i]['IsHidden']:
-                ret.hidden_changed_count += 1
-        for i in ret.changed:
-            if ret.new_api[i]['IsHidden'] and ret.old_api[i]['IsHidden']:
-                ret.hidden_changed_count += 1
-
-        return ret
+        print('[APIDB] {}: Added: {}, Changed: {}, Removed: {}'.format(
+            category, len(ret.added), len(ret.changed), len(ret.removed)))
+        item_dict = {docId: ret.new_api[docId]
+                     for docId in ret.added | ret.changed}
+        # Store hashes of the members imported before hashes existed.
+        for docId, info in ret.unhashed.items():
+            item_dict[docId] = _decode_info(info)
+        return self._backend.write(category, item_dict, ret.removed)
+
+
+def _read_members(jsonfile):
+    for docId, info in apitool.iter_members(jsonfile):
+        info = canonical_json(info)
+        yield docId, info_digest(info), info
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Samsung Electronics Co., Ltd All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import uuid
+import random
+import tempfile
+import threading
+from datetime import datetime
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeSerializer
+from common.apidb import (APIDBError, canonical_json, info_digest,
+                          compare_sets)
+
+TABLE_NAME = 'TizenFX_API_Members'
+REGION_NAME = 'ap-northeast-2'
+
+BATCH_WRITE_SIZE = 25  # Maximum number of requests in a BatchWriteItem call
+BATCH_WRITE_WORKERS = 8
+BATCH_WRITE_MAX_RETRIES = 8
+BATCH_WRITE_BACKOFF_BASE = 0.05
+BATCH_WRITE_BACKOFF_MAX = 5.0
+BATCH_WRITE_PROGRESS_INTERVAL = 1000
+
+# Items of this category hold the snapshot stamp of each API category,
+# keyed by the name of the category in DocId.
+STAMP_CATEGORY = '_SnapshotStamp'
+SNAPSHOT_FORMAT = 3
+
+BATCH_GET_SIZE = 100  # Maximum number of keys in a BatchGetItem call
+
+
+class BatchWriter:
+    """Writes items to a DynamoDB table in batches with concurrent workers.
+
+    Requests are grouped into BatchWriteItem calls of BATCH_WRITE_SIZE and
+    sent from a thread pool. Unprocessed items returned by DynamoDB are
+    retried with exponential backoff. Use it as a context manager; leaving
+    the context waits for all pending batches and prints a summary.
+    """
+
+    def __init__(self, client, table_name,
+                 workers=BATCH_WRITE_WORKERS,
+                 max_retries=BATCH_WRITE_MAX_RETRIES):
+        self.put_count = 0
+        self.delete_count = 0
+        self.retry_count = 0
+        self._client = client
+        self._table_name = table_name
+        self._workers = workers
+        self._max_retries = max_retries
+        self._serializer = TypeSerializer()
+        self._requests = []
+        self._executor = None
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._next_progress = BATCH_WRITE_PROGRESS_INTERVAL
+        self._started = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        self._started = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._submit()
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+        print('[APIDB] PUT: {}, DELETE: {}, RETRIES: {} ({:.1f}s)'.format(
+            self.put_count, self.delete_count, self.retry_count,
+            time() - self._started))
+
+    def put(self, item):
+        self._add({'PutRequest': {'Item': self._serialize(item)}})
+
+    def delete(self, key):
+        self._add({'DeleteRequest': {'Key': self._serialize(key)}})
+
+    def _serialize(self, item):
+        return {k: self._serializer.serialize(v) for k, v in item.items()}
+
+    def _add(self, request):
+        self._requests.append(request)
+        if len(self._requests) >= BATCH_WRITE_SIZE:
+            self._submit()
+
+    def _submit(self):
+        if not self._requests:
+            return
+        batch = self._requests
+        self._requests = []
+        # Bound the number of in-flight batches to keep memory flat.
+        self._slots.acquire()
+        future = self._executor.submit(self._write_batch, batch)
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+
+    def _write_batch(self, batch):
+        pending = batch
+        for attempt in range(self._max_retries + 1):
+            response = self._client.batch_write_item(
+                RequestItems={self._table_name: pending})
+            unprocessed = response.get('UnprocessedItems', {}) \
+                .get(self._table_name, [])
+            self._count_done(pending, unprocessed)
+            if not unprocessed:
+                return
+            pending = unprocessed
+            with self._lock:
+                self.retry_count += 1
+            delay = min(BATCH_WRITE_BACKOFF_MAX,
+                        BATCH_WRITE_BACKOFF_BASE * (2 ** attempt))
+            sleep(random.uniform(delay / 2, delay))
+        raise APIDBError('{} items were not processed after {} retries.'
+                         .format(len(pending), self._max_retries))
+
+    def _count_done(self, requests, unprocessed):
+        def count_puts(reqs):
+            return sum(1 for r in reqs if 'PutRequest' in r)
+        puts = count_puts(requests) - count_puts(unprocessed)
+        deletes = len(requests) - len(unprocessed) - puts
+        with self._lock:
+            self.put_count += puts
+            self.delete_count += deletes
+            written = self.put_count + self.delete_count
+            if written >= self._next_progress:
+                print('[APIDB] {} items written...'.format(written))
+                self._next_progress += BATCH_WRITE_PROGRESS_INTERVAL
+
+
+class DynamoDBBackend:
+    def __init__(self, env):
+        db = boto3.resource('dynamodb', region_name=REGION_NAME,
+                            endpoint_url=getattr(env, 'apidb_endpoint_url',
+                                                 None))
+        self._db = db
+        self._table = db.Table(TABLE_NAME)
+        self._client = db.meta.client
+        self._cache_dir = getattr(env, 'apidb_cache_dir', None)
+        if self._cache_dir:
+            self._cache_dir = os.path.expanduser(self._cache_dir)
+
+    def compare(self, category, newset):
+        # compare_sets() keeps the new Info, and reads the old Info of the
+        # changed and removed members in batches.
+        return compare_sets(
+            self._load_category(category), newset,
+            fetch_old=lambda docIds: self._get_infos(category, docIds))
+
+    def write(self, category, item_dict, keys):
+        if item_dict or keys:
+            # Until the new stamp is set, no snapshot of the category is
+            # valid, so readers query the table during a partial write and
+            # after a failed one.
+            self.clear_stamp(category)
+        with BatchWriter(self._client, TABLE_NAME) as writer:
+            for docId in item_dict:
+                writer.put({
+                    'DocId': docId,
+                    'Category': category,
+                    'Info': item_dict[docId],
+                    'Hash': info_digest(item_dict[docId])
+                })
+            for docId in keys:
+                writer.delete({
+                    'DocId': docId,
+                    'Category': category
+                })
+        if item_dict or keys or self.get_stamp(category) is None:
+            print('[APIDB] New snapshot stamp of {}: {}'.format(
+                category, self.update_stamp(category)))
+        return writer.put_count, writer.delete_count
+
+    def get_stamp(self, category):
+        response = self._table.get_item(
+            Key={'DocId': category, 'Category': STAMP_CATEGORY},
+            ConsistentRead=True
+        )
+        return response.get('Item', {}).get('Stamp')
+
+    def clear_stamp(self, category):
+        self._table.delete_item(
+            Key={'DocId': category, 'Category': STAMP_CATEGORY})
+
+    def update_stamp(self, category):
+        stamp = '{:%Y%m%d%H%M%S}-{}'.format(
+            datetime.utcnow(), uuid.uuid4().hex[:8])
+        self._table.put_item(
+            Item={
+                'DocId': category,
+                'Category': STAMP_CATEGORY,
+                'Stamp': stamp
+            }
+        )
+        return stamp
+
+    def _load_category(self, category):
+        """Returns a dict of DocId to (Hash, Info) of the category.
+
+        Info is None, to be loaded on demand, unless Hash is None for items
+        stored before hashes were introduced. Info may be left as a JSON
+        string when loaded from a snapshot.
+        """
+        if not self._cache_dir:
+            return self._query_category(category)
+
+        stamp = self.get_stamp(category)
+        if stamp is None:
+            # The updater has never stamped this category, so there is
+            # no way to tell whether a snapshot is still valid.
+            return self._query_category(category)
+
+        snapshot_file = os.path.join(self._cache_dir, category + '.json')
+        try:
+            with open(snapshot_file) as f:
+                snapshot = json.load(f)
+            if snapshot['Format'] == SNAPSHOT_FORMAT and \
+                    snapshot['Category'] == category and \
+                    snapshot['Stamp'] == stamp:
+                print('[APIDB] Use snapshot {} of {}'.format(stamp, category))
+                return {row[0]: (row[1], row[2]) for row in snapshot['Items']}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        items = self._query_category(category)
+        self._save_snapshot(snapshot_file, {
+            'Format': SNAPSHOT_FORMAT,
+            'Category': category,
+            'Stamp': stamp,
+            'Items': [[docId, h,
+                       canonical_json(info) if info is not None else None]
+                      for docId, (h, info) in items.items()]
+        })
+        return items
+
+    def _save_snapshot(self, snapshot_file, snapshot):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmpfile, snapshot_file)
+        except:
+            os.remove(tmpfile)
+            raise
+
+    def _query_category(self, category):
+        kce = Key('Category').eq(category)
+        # Hash is a reserved word in DynamoDB expressions.
+        query = dict(IndexName='Category-DocId-index',
+                     KeyConditionExpression=kce,
+                     ProjectionExpression='#d, #h',
+                     ExpressionAttributeNames={'#d': 'DocId', '#h': 'Hash'})
+
+        response = self._table.query(**query)
+        oldset = dict()
+        unhashed = []
+        while True:
+            for i in response['Items']:
+                oldset[i['DocId']] = (i.get('Hash'), None)
+                if i.get('Hash') is None:
+                    unhashed.append(i['DocId'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            response = self._table.query(
+                ExclusiveStartKey=response['LastEvaluatedKey'], **query)
+
+        # Items without Hash are compared by their Info.
+        for docId, info in self._get_infos(category, unhashed):
+            oldset[docId] = (None, info)
+        return oldset
+
+    def _get_infos(self, category, docIds):
+        """Yields (DocId, Info) of the members with BatchGetItem."""
+        for start in range(0, len(docIds), BATCH_GET_SIZE):
+            keys = [{'DocId': docId, 'Category': category}
+                    for docId in docIds[start:start + BATCH_GET_SIZE]]
+            for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+                response = self._db.batch_get_item(RequestItems={
+                    TABLE_NAME: {
+                        'Keys': keys,
+                        'ProjectionExpression': '#d, #i',
+                        'ExpressionAttributeNames': {'#d': 'DocId',
+                                                     '#i': 'Info'},
+                        'ConsistentRead': True
+                    }
+                })
+                for i in response['Responses'].get(TABLE_NAME, []):
+                    yield i['DocId'], i['Info']
+                keys = response.get('UnprocessedKeys', {}) \
+                    .get(TABLE_NAME, {}).get('Keys')
+                if not keys:
+                    break
+                delay = min(BATCH_WRITE_BACKOFF_MAX,
+                            BATCH_WRITE_BACKOFF_BASE * (2 ** attempt))
+                sleep(random.uniform(delay / 2, delay))
+            else:
+                raise APIDBError('{} items were not read after {} retries.'
+                                 .format(len(keys), BATCH_WRITE_MAX_RETRIES))
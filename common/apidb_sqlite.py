@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Samsung Electronics Co., Ltd All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sqlite3
+from common.apidb import APIComparisonResult, canonical_json, info_digest
+
+# Seconds to wait for other jobs writing to the same database
+SQLITE_TIMEOUT = 300
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS Members (
+    Category TEXT NOT NULL,
+    DocId TEXT NOT NULL,
+    Hash TEXT NOT NULL,
+    Info TEXT NOT NULL,
+    PRIMARY KEY (Category, DocId)
+);
+CREATE INDEX IF NOT EXISTS Members_Category_Hash
+    ON Members (Category, Hash);
+'''
+
+
+class SQLiteBackend:
+    """APIDB backend storing the members in a local SQLite database.
+
+    Info is stored as canonical JSON. compare() loads the new set into a
+    temporary table and lets SQLite compute the added, removed and changed
+    sets. The Info of a member is read from the database only when the
+    comparison result asks for it, so the result is valid until the next
+    compare() or write().
+    """
+
+    def __init__(self, env):
+        path = os.path.expanduser(env.apidb_sqlite_path)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+        self._conn.executescript(SCHEMA)
+
+    def compare(self, category, newset):
+        conn = self._conn
+        conn.executescript('''
+            DROP TABLE IF EXISTS temp.NewMembers;
+            CREATE TEMP TABLE NewMembers (
+                DocId TEXT PRIMARY KEY,
+                Hash TEXT NOT NULL,
+                Info TEXT NOT NULL
+            );
+        ''')
+        conn.executemany(
+            'INSERT OR REPLACE INTO temp.NewMembers VALUES (?, ?, ?)', newset)
+
+        ret = APIComparisonResult(loader=self._make_loader(category))
+        added = conn.execute('''
+            SELECT n.DocId, json_extract(n.Info, '$.IsHidden')
+            FROM temp.NewMembers n
+            WHERE NOT EXISTS (
+                SELECT 1 FROM Members m
+                WHERE m.Category = ? AND m.DocId = n.DocId)
+        ''', (category,))
+        for docId, hidden in added:
+            ret.add_change('added', docId, new_hidden=hidden)
+
+        removed = conn.execute('''
+            SELECT m.DocId, json_extract(m.Info, '$.IsHidden')
+            FROM Members m
+            WHERE m.Category = ? AND NOT EXISTS (
+                SELECT 1 FROM temp.NewMembers n WHERE n.DocId = m.DocId)
+        ''', (category,))
+        for docId, hidden in removed:
+            ret.add_change('removed', docId, old_hidden=hidden)
+
+        changed = conn.execute('''
+            SELECT n.DocId, json_extract(m.Info, '$.IsHidden'),
+                   json_extract(n.Info, '$.IsHidden')
+            FROM temp.NewMembers n
+            JOIN Members m ON m.Category = ? AND m.DocId = n.DocId
+            WHERE m.Hash != n.Hash
+        ''', (category,))
+        for docId, old_hidden, new_hidden in changed:
+            ret.add_change('changed', docId,
+                           old_hidden=old_hidden, new_hidden=new_hidden)
+
+        ret.count_changes()
+        return ret
+
+    def _make_loader(self, category):
+        def load(docId, side):
+            if side == 'old':
+                row = self._conn.execute(
+                    'SELECT Info FROM Members '
+                    'WHERE Category = ? AND DocId = ?',
+                    (category, docId)).fetchone()
+            else:
+                row = self._conn.execute(
+                    'SELECT Info FROM temp.NewMembers WHERE DocId = ?',
+                    (docId,)).fetchone()
+            if row is None:
+                raise KeyError(docId)
+            return row[0]
+        return load
+
+    def write(self, category, item_dict, keys):
+        def rows():
+            for docId, info in item_dict.items():
+                info = canonical_json(info)
+                yield category, docId, info_digest(info), info
+
+        with self._conn:
+            cursor = self._conn.executemany(
+                'INSERT OR REPLACE INTO Members VALUES (?, ?, ?, ?)', rows())
+            put_count = cursor.rowcount
+            cursor = self._conn.executemany(
+                'DELETE FROM Members WHERE Category = ? AND DocId = ?',
+                ((category, docId) for docId in keys))
+            delete_count = cursor.rowcount
+        print('[APIDB] PUT: {}, DELETE: {}'.format(put_count, delete_count))
+        return put_count, delete_count
+
@@ -15,18 +15,185 @@
 # limitations under the License.
 
 import os
+import re
+import json
+import heapq
+import hashlib
+import tempfile
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 from common.shell import sh
 from common.project import ProjectError
 
 APITOOL_PATH = '../tools/bin/APITool.dll'
+READ_CHUNK_SIZE = 1024 * 1024
+CACHE_FORMAT = 2
 
+_WHITESPACE = re.compile(r'\s*')
 
-def extract(proj, output):
+
+def extract(proj, output, cache_dir=None, workers=1):
+    """Extracts APIs of the public assemblies of the project to output.
+
+    If cache_dir is given, each assembly is extracted on its own and the
+    result is kept in cache_dir, keyed by the content hash of the assembly
+    and of APITool. Only assemblies not found in the cache are analyzed.
+
+    With more than one worker, APITool runs on each assembly in parallel,
+    since it takes only one target. Whenever the output is made of the
+    parts of several assemblies, each part is sorted and they are merged
+    into output sorted by DocId. A single run on the whole directory is
+    written as APITool makes it, without holding the members in memory.
+    """
     artifacts_dir = os.path.join(proj.workspace, 'Artifacts/bin/public')
     if not os.path.isdir(artifacts_dir):
         raise ProjectError('No Artifacts')
+    if not cache_dir and workers <= 1:
+        _run_apitool(output, artifacts_dir)
+        return
+
+    dlls = sorted(glob(os.path.join(artifacts_dir, '*.dll')))
+    if cache_dir:
+        _extract_with_cache(dlls, output, os.path.expanduser(cache_dir),
+                            workers)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jsonfiles = [os.path.join(tmpdir, '{}.json'.format(i))
+                         for i in range(len(dlls))]
+            _run_parallel(list(zip(jsonfiles, dlls)), workers)
+            merge(jsonfiles, output)
+
+
+def merge(jsonfiles, output):
+    """Merges the JSON files made by APITool into output.
+
+    Each file must be sorted by DocId; the output is sorted by DocId too.
+    """
+    members = heapq.merge(*[iter_members(f) for f in jsonfiles],
+                          key=lambda m: m[0])
+    _write_members(output, members)
+
+
+def _extract_with_cache(dlls, output, cache_dir, workers):
+    os.makedirs(cache_dir, exist_ok=True)
+    tool_hash = _file_digest(_apitool_path())
+
+    jsonfiles = []
+    jobs = []
+    for dll in dlls:
+        key = hashlib.sha1('{}:{}:{}'.format(
+            CACHE_FORMAT, tool_hash, _file_digest(dll)).encode('utf-8'))
+        jsonfile = os.path.join(cache_dir, key.hexdigest() + '.json')
+        if not os.path.exists(jsonfile):
+            jobs.append((jsonfile, dll))
+        jsonfiles.append(jsonfile)
+    print('[APITool] {} of {} assemblies are found in the cache.'
+          .format(len(dlls) - len(jobs), len(dlls)))
+
+    _run_parallel(jobs, workers)
+    merge(jsonfiles, output)
+
+
+def _run_parallel(jobs, workers):
+    """Runs APITool for each (output, target) in jobs with a worker pool.
+
+    Each output is sorted by DocId and is moved into place only when the
+    run succeeds.
+    """
+    def run(job):
+        output, target = job
+        tmpfile = '{}.{}.tmp'.format(output, os.getpid())
+        _run_apitool(tmpfile, target)
+        _write_members(tmpfile, sorted(iter_members(tmpfile),
+                                       key=lambda m: m[0]))
+        os.replace(tmpfile, output)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for _ in executor.map(run, jobs):
+            pass
+
+
+def _write_members(output, members):
+    with open(output, 'w') as f:
+        f.write('[')
+        sep = '\n'
+        for docId, info in members:
+            f.write(sep)
+            json.dump({'DocId': docId, 'Info': info}, f)
+            sep = ',\n'
+        f.write('\n]\n')
+
+
+def _apitool_path():
+    return os.path.join(os.path.dirname(__file__), APITOOL_PATH)
+
+
+def _run_apitool(output, target):
     apitool_cmd = [
-        os.path.join(os.path.dirname(__file__), APITOOL_PATH),
+        _apitool_path(),
         'print', '--include-hidden', '--format=json',
-        '-o ' + output, artifacts_dir]
+        '-o ' + output, target]
     sh('dotnet', apitool_cmd)
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_members(jsonfile):
+    """Yields (DocId, Info) of each member in a JSON file made by extract().
+
+    The file is a JSON array of {"DocId": ..., "Info": ...} objects. It is
+    read in chunks and decoded one member at a time, so the whole array is
+    never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(jsonfile) as f:
+        buf = ''
+        pos = 0
+        eof = False
+        expect = '['
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                if eof:
+                    raise ValueError('Unexpected end of ' + jsonfile)
+                buf = f.read(READ_CHUNK_SIZE)
+                pos = 0
+                eof = not buf
+                continue
+
+            c = buf[pos]
+            if expect == '[':
+                if c != '[':
+                    raise ValueError('{} is not a JSON array'.format(jsonfile))
+                pos += 1
+                expect = 'member'
+                continue
+            if c == ']':
+                return
+            if expect == ',':
+                if c != ',':
+                    raise ValueError('Invalid JSON in {} at offset {}'
+                                     .format(jsonfile, f.tell()))
+                pos += 1
+                expect = 'member'
+                continue
+
+            try:
+                member, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # The member is cut off at the end of the buffer.
+                if eof:
+                    raise
+                chunk = f.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            expect = ','
+            yield member['DocId'], member['Info']
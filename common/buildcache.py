@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Samsung Electronics Co., Ltd All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shlex
+import shutil
+import hashlib
+import tarfile
+from common.shell import sh
+
+CACHE_FORMAT = 1
+CACHED_PATHS = ['Artifacts', 'msbuild.log']
+
+
+class BuildCache:
+    """Keeps the outputs of builds in a directory, keyed by the source tree.
+
+    An entry is a tar file of CACHED_PATHS of the workspace, named after
+    the git tree hash of HEAD and the build flags. A workspace with local
+    changes has no key, so it is never cached. Least recently used entries
+    are removed when the directory grows beyond max_size bytes.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+
+    def key(self, workspace, flags, rev=None):
+        """Returns the key of the workspace built with flags, or None.
+
+        If rev is given, the key is of the commit rev of the workspace
+        instead of its working tree.
+        """
+        if rev is None:
+            status = sh('git status --porcelain', cwd=workspace,
+                        print_stdout=False, return_stdout=True)
+            for line in status.splitlines():
+                path = line[3:].strip('"')
+                if path.split('/')[0] not in CACHED_PATHS:
+                    return None
+            rev = 'HEAD'
+
+        tree = sh('git rev-parse {}^{{tree}}'.format(shlex.quote(rev)),
+                  cwd=workspace, print_stdout=False,
+                  return_stdout=True).strip()
+        flags = ','.join('{}={}'.format(k, flags[k]) for k in sorted(flags))
+        return hashlib.sha1('{}:{}:{}'.format(
+            CACHE_FORMAT, tree, flags).encode('utf-8')).hexdigest()
+
+    def restore(self, key, workspace, names=CACHED_PATHS):
+        """Replaces the outputs in workspace with the entry of key.
+
+        Only the outputs in names are replaced. Returns False if there is
+        no such entry.
+        """
+        entry = self._entry_path(key)
+        if not os.path.exists(entry):
+            return False
+        self._remove_outputs(workspace, names)
+        with tarfile.open(entry) as tar:
+            members = [m for m in tar.getmembers()
+                       if m.name.split('/')[0] in names]
+            tar.extractall(workspace, members)
+        os.utime(entry)
+        return True
+
+    def store(self, key, workspace):
+        """Adds the outputs in workspace as the entry of key."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = self._entry_path(key)
+        tmpfile = '{}.{}.tmp'.format(entry, os.getpid())
+        with tarfile.open(tmpfile, 'w') as tar:
+            for name in CACHED_PATHS:
+                path = os.path.join(workspace, name)
+                if os.path.exists(path):
+                    tar.add(path, arcname=name)
+        os.replace(tmpfile, entry)
+        self._evict()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.tar')
+
+    def _remove_outputs(self, workspace, names):
+        for name in names:
+            path = os.path.join(workspace, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tar'):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            print('[BuildCache] Evicted {}'.format(name))
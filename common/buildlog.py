@@ -14,29 +14,189 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
+from time import sleep
+
+LOG_PATTERN = re.compile(
+    r'([0-9]+)(?::[0-9]+)?>(.+)\(([0-9]+),[0-9]+\): '
+    r'(error|warning) ([A-Z0-9]+): (.+) \[/')
+READ_CHUNK_SIZE = 1024 * 1024
+FOLLOW_INTERVAL = 1.0
+
+
+def iter_log_items(filePath):
+    """Yields warnings and errors of a msbuild log one by one.
+
+    The log is read in chunks, and the regex only runs on the lines which
+    look like a diagnostic. The file is closed as soon as the generator is
+    exhausted or closed.
+    """
+    with open(filePath, 'r', errors='replace') as f:
+        rest = ''
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), ''):
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                item = _parse_line(line)
+                if item is not None:
+                    yield item
+        item = _parse_line(rest)
+        if item is not None:
+            yield item
+
+
+def follow_log_items(filePath, is_running, interval=FOLLOW_INTERVAL):
+    """Yields warnings and errors as they are written to a msbuild log.
+
+    The file is followed like 'tail -f' while is_running() returns True,
+    waiting for it to be created if needed. Once is_running() returns
+    False, the rest of the file is read and the generator stops.
+    """
+    f = None
+    rest = ''
+    try:
+        while True:
+            running = is_running()
+            if f is None and os.path.exists(filePath):
+                f = open(filePath, 'r', errors='replace')
+            if f is not None:
+                for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), ''):
+                    lines = (rest + chunk).split('\n')
+                    rest = lines.pop()
+                    for line in lines:
+                        item = _parse_line(line)
+                        if item is not None:
+                            yield item
+            if not running:
+                break
+            sleep(interval)
+        item = _parse_line(rest)
+        if item is not None:
+            yield item
+    finally:
+        if f is not None:
+            f.close()
+
+
+def _parse_line(line):
+    if '): warning ' not in line and '): error ' not in line:
+        return None
+    m = LOG_PATTERN.match(line.strip())
+    if m is None:
+        return None
+    return {'file': m.group(2),
+            'line': int(m.group(3)), 'type': m.group(4),
+            'code': m.group(5), 'message': m.group(6),
+            'node': int(m.group(1))}
+
+
+def aggregate(items):
+    """Collapses identical (file, line, code, message) items.
+
+    With parallel MSBuild, the same diagnostic is logged once per node or
+    target framework. Each returned item is the first occurrence with
+    'count', the number of occurrences, and 'nodes', the sorted list of
+    nodes that logged it. The order of first occurrences is kept.
+    """
+    groups = {}
+    for item in items:
+        key = (item['file'], item['line'], item['code'], item['message'])
+        agg = groups.get(key)
+        if agg is None:
+            agg = dict(item, count=0, nodes=[])
+            del agg['node']
+            groups[key] = agg
+        agg['count'] += 1
+        if item['node'] not in agg['nodes']:
+            agg['nodes'].append(item['node'])
+    for agg in groups.values():
+        agg['nodes'].sort()
+    return list(groups.values())
 
 
 class BuildLog:
     def __init__(self, filePath):
-        self.warnings = []
-        self.errors = []
-        self._file = open(filePath, 'r')
-        self._parseLog()
+        self._filePath = filePath
+        self._warnings = None
+        self._errors = None
+        self._unique_warnings = None
+        self._unique_errors = None
+
+    @property
+    def warnings(self):
+        if self._warnings is None:
+            self._parseLog()
+        return self._warnings
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            self._parseLog()
+        return self._errors
+
+    @property
+    def unique_warnings(self):
+        if self._unique_warnings is None:
+            self._unique_warnings = aggregate(self.warnings)
+        return self._unique_warnings
+
+    @property
+    def unique_errors(self):
+        if self._unique_errors is None:
+            self._unique_errors = aggregate(self.errors)
+        return self._unique_errors
+
+    def warning_summary(self):
+        """Returns a dict of warning code to its statistics.
+
+        'count' is the number of occurrences in the log, 'unique' the
+        number of distinct warnings and 'files' the number of files.
+        """
+        summary = {}
+        files = {}
+        for warn in self.unique_warnings:
+            stat = summary.setdefault(
+                warn['code'], {'count': 0, 'unique': 0, 'files': 0})
+            stat['count'] += warn['count']
+            stat['unique'] += 1
+            files.setdefault(warn['code'], set()).add(warn['file'])
+        for code, stat in summary.items():
+            stat['files'] = len(files[code])
+        return summary
+
+    def follow(self, is_running):
+        """Yields warnings and errors while the build is still writing.
+
+        Once the log is followed to the end, the items are kept for the
+        other properties, so the log is not parsed again.
+        """
+        warnings = []
+        errors = []
+        for item in follow_log_items(self._filePath, is_running):
+            if item['type'] == 'warning':
+                warnings.append(item)
+            elif item['type'] == 'error':
+                errors.append(item)
+            yield item
+        self._warnings = warnings
+        self._errors = errors
+
+    def iter_warnings(self):
+        for item in iter_log_items(self._filePath):
+            if item['type'] == 'warning':
+                yield item
+
+    def iter_errors(self):
+        for item in iter_log_items(self._filePath):
+            if item['type'] == 'error':
+                yield item
 
     def _parseLog(self):
-        pattern = re.compile(
-            r'[0-9:]+>(.+)\(([0-9]+),[0-9]+\): (error|warning) ([A-Z0-9]+): (.+) \[/')
-        for line in self._file.readlines():
-            m = pattern.match(line.strip())
-            if m is not None:
-                item = {'file': m.group(1),
-                        'line': int(m.group(2)), 'type': m.group(3),
-                        'code': m.group(4), 'message': m.group(5)}
-                if item['type'] == 'warning':
-                    self.warnings.append(item)
-                elif item['type'] == 'error':
-                    self.errors.append(item)
-
-    def __del__(self):
-        self._file.close()
+        self._warnings = []
+        self._errors = []
+        for item in iter_log_items(self._filePath):
+            if item['type'] == 'warning':
+                self._warnings.append(item)
+            elif item['type'] == 'error':
+                self._errors.append(item)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Samsung Electronics Co., Ltd All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import tempfile
+import threading
+from time import sleep, time
+from collections import Counter
+import requests
+from github import Github, GithubException, RateLimitExceededException
+
+API_URL = 'https://api.github.com'
+
+# Calls are spread out until the reset time once fewer requests than this
+# are left in the primary rate limit.
+LOW_RATE_LIMIT = 200
+MAX_RETRIES = 5
+RETRY_BACKOFF_BASE = 2.0
+RETRY_BACKOFF_MAX = 120.0
+# Delay between mutations is raised on each secondary rate limit hit and
+# decays back on every successful mutation.
+MUTATION_INTERVAL_MIN = 1.0
+MUTATION_INTERVAL_MAX = 10.0
+MUTATION_INTERVAL_DECAY = 0.8
+ETAG_CACHE_MAX_ENTRIES = 500
+
+
+class GithubClient:
+    """Rate-limit-aware access to the GitHub API.
+
+    Mutations go through PyGithub with call(), and repeated reads go
+    through get(), which sends ETag conditional requests; a 304 response
+    does not count against the rate limit. Both read the rate limit from
+    the response headers, spread calls out when few requests are left and
+    back off on secondary rate limits. counters keeps the number of calls
+    by name for the job summary.
+    """
+
+    def __init__(self, token, etag_cache_file=None):
+        self.github = Github(token)
+        self.counters = Counter()
+        self._session = requests.Session()
+        self._session.headers.update({
+            'Authorization': 'token ' + token,
+            'Accept': 'application/vnd.github.v3+json'
+        })
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._reset_time = None
+        self._interval = 0.0
+        self._next_mutation = 0.0
+        self._etag_cache_file = etag_cache_file
+        if etag_cache_file:
+            self._etag_cache_file = os.path.expanduser(etag_cache_file)
+        self._etags = self._load_etags()
+
+    def call(self, name, fn, *args, mutation=False, **kwargs):
+        """Calls a PyGithub method, throttled and retried on rate limits."""
+        for attempt in range(MAX_RETRIES + 1):
+            self._throttle(mutation)
+            self._count(name)
+            try:
+                ret = fn(*args, **kwargs)
+            except GithubException as err:
+                if attempt == MAX_RETRIES or not _is_rate_limited(err):
+                    raise
+                self._back_off(name, attempt, getattr(err, 'headers', None))
+                continue
+            finally:
+                self._update_rate_limit_from_github()
+            if mutation:
+                with self._lock:
+                    self._interval *= MUTATION_INTERVAL_DECAY
+            return ret
+
+    def get(self, name, path):
+        """Reads all pages of a GitHub API path with conditional requests.
+
+        Returns the decoded JSON; the pages of a list are concatenated.
+        """
+        url = API_URL + path
+        pages = []
+        while url:
+            data, url = self._get_page(name, url)
+            pages.append(data)
+        if len(pages) == 1:
+            return pages[0]
+        return [item for page in pages for item in page]
+
+    def print_stats(self):
+        with self._lock:
+            total = sum(self.counters.values())
+            print('[GitHub] {} API calls (rate limit remaining: {})'.format(
+                total, self._remaining))
+            for name, count in sorted(self.counters.items()):
+                print('[GitHub]   {}: {}'.format(name, count))
+
+    def close(self):
+        self._save_etags()
+
+    def _get_page(self, name, url):
+        for attempt in range(MAX_RETRIES + 1):
+            with self._lock:
+                cached = self._etags.get(url)
+            headers = {}
+            if cached is not None:
+                headers['If-None-Match'] = cached['etag']
+
+            self._throttle(False)
+            response = self._session.get(url, headers=headers)
+            self._update_rate_limit(response.headers)
+            if response.status_code == 304:
+                self._count(name + ' (not modified)')
+                return cached['data'], cached['next']
+            self._count(name)
+            if response.status_code in (403, 429) and \
+                    _is_rate_limit_response(response) and \
+                    attempt < MAX_RETRIES:
+                self._back_off(name, attempt, response.headers)
+                continue
+            if response.status_code >= 400:
+                raise GithubException(response.status_code,
+                                      _decode_json(response),
+                                      dict(response.headers))
+
+            data = response.json()
+            next_url = response.links.get('next', {}).get('url')
+            if 'ETag' in response.headers:
+                with self._lock:
+                    self._etags[url] = {'etag': response.headers['ETag'],
+                                        'data': data, 'next': next_url,
+                                        'time': time()}
+            return data, next_url
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _throttle(self, mutation):
+        with self._lock:
+            now = time()
+            wait = 0.0
+            if self._remaining is not None and \
+                    self._remaining < LOW_RATE_LIMIT and \
+                    self._reset_time is not None:
+                wait = max(0.0, self._reset_time - now) / \
+                    max(self._remaining, 1)
+            if mutation:
+                wait = max(wait, self._next_mutation - now)
+                self._next_mutation = now + wait + self._interval
+        if wait > 0:
+            print('[GitHub] Throttling for {:.1f}s'.format(wait))
+            sleep(wait)
+
+    def _back_off(self, name, attempt, headers):
+        wait = None
+        if headers:
+            retry_after = headers.get('Retry-After') or \
+                headers.get('retry-after')
+            if retry_after is not None:
+                wait = float(retry_after)
+        if wait is None:
+            wait = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt))
+        with self._lock:
+            self._interval = min(MUTATION_INTERVAL_MAX,
+                                 max(MUTATION_INTERVAL_MIN,
+                                     self._interval * 2))
+        print('[GitHub] Rate limited on {}. Retry in {:.1f}s'
+              .format(name, wait))
+        sleep(wait)
+
+    def _update_rate_limit(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        with self._lock:
+            if remaining is not None:
+                self._remaining = int(remaining)
+            if reset is not None:
+                self._reset_time = float(reset)
+
+    def _update_rate_limit_from_github(self):
+        # PyGithub keeps the rate limit headers of its last response.
+        remaining, _ = self.github.rate_limiting
+        with self._lock:
+            self._remaining = remaining
+            self._reset_time = self.github.rate_limiting_resettime
+
+    def _load_etags(self):
+        if not self._etag_cache_file:
+            return {}
+        try:
+            with open(self._etag_cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_etags(self):
+        if not self._etag_cache_file:
+            return
+        with self._lock:
+            entries = sorted(self._etags.items(),
+                             key=lambda e: e[1]['time'], reverse=True)
+            etags = dict(entries[:ETAG_CACHE_MAX_ENTRIES])
+        cache_dir = os.path.dirname(self._etag_cache_file)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(etags, f)
+            os.replace(tmpfile, self._etag_cache_file)
+        except:
+            os.remove(tmpfile)
+            raise
+
+
+def _is_rate_limited(err):
+    if isinstance(err, RateLimitExceededException):
+        return True
+    if err.status not in (403, 429):
+        return False
+    return 'rate limit' in str(err.data).lower()
+
+
+def _is_rate_limit_response(response):
+    if response.headers.get('X-RateLimit-Remaining') == '0':
+        return True
+    return 'rate limit' in response.text.lower()
+
+
+def _decode_json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {'message': response.text}
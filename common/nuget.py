@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Samsung Electronics Co., Ltd All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import random
+import zipfile
+import threading
+import urllib.error
+import urllib.request
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from common.shell import sh, ShellError
+
+PUSH_TIMEOUT = 3000
+FEED_CHECK_TIMEOUT = 30
+RETRY_BASE_DELAY = 5
+
+
+class PushError(Exception):
+    """Raised when some packages are failed to push."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def package_identity(nupkg):
+    """Returns (id, version) in the nuspec of the package."""
+    with zipfile.ZipFile(nupkg) as z:
+        name = next(n for n in z.namelist()
+                    if n.endswith('.nuspec') and '/' not in n)
+        root = ElementTree.fromstring(z.read(name))
+    values = {}
+    for elem in root.iter():
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag in ('id', 'version') and tag not in values:
+            values[tag] = elem.text.strip()
+    return values['id'], values['version']
+
+
+class PackagePusher:
+    """Pushes packages to a feed with a pool of workers.
+
+    Packages which are already on the feed are skipped. They are looked up
+    in the flat container of the feed (NuGet v3), if flat_url is given, and
+    in record_file, where the packages pushed by this agent are written.
+    A failed push is retried with backoff.
+    """
+
+    def __init__(self, apikey, source, workers=1, retries=0,
+                 flat_url=None, record_file=None):
+        self.apikey = apikey
+        self.source = source
+        self.workers = workers
+        self.retries = retries
+        self.flat_url = flat_url
+        self.record_file = record_file
+        if record_file:
+            self.record_file = os.path.expanduser(record_file)
+        self._record_lock = threading.Lock()
+        self._recorded = self._read_record()
+
+    def push(self, nupkgs, cwd=None):
+        """Pushes the packages and returns the number of pushed ones.
+
+        dotnet runs in cwd, to use the NuGet.config there.
+        """
+        nupkgs = [os.path.abspath(p) for p in nupkgs]
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            results = list(executor.map(
+                lambda p: self._push_one(p, cwd), nupkgs))
+
+        pushed = results.count('pushed')
+        skipped = results.count('skipped')
+        failed = [os.path.basename(p) for p, r in zip(nupkgs, results)
+                  if isinstance(r, ShellError)]
+        print('[NuGet] Pushed: {}, Skipped: {}, Failed: {}'
+              .format(pushed, skipped, len(failed)))
+        if failed:
+            raise PushError('Failed to push ' + ', '.join(failed))
+        return pushed
+
+    def is_published(self, pkg_id, version):
+        if (pkg_id.lower(), version.lower()) in self._recorded:
+            return True
+        if not self.flat_url:
+            return False
+        url = '{0}/{1}/{2}/{1}.{2}.nupkg'.format(
+            self.flat_url.rstrip('/'), pkg_id.lower(), version.lower())
+        try:
+            req = urllib.request.Request(url, method='HEAD')
+            with urllib.request.urlopen(req, timeout=FEED_CHECK_TIMEOUT):
+                return True
+        except urllib.error.HTTPError as err:
+            if err.code != 404:
+                print('[NuGet] Failed to look up {} {}: {}'
+                      .format(pkg_id, version, err))
+            return False
+        except (urllib.error.URLError, OSError) as err:
+            print('[NuGet] Failed to look up {} {}: {}'
+                  .format(pkg_id, version, err))
+            return False
+
+    def _push_one(self, nupkg, cwd):
+        pkg_id, version = package_identity(nupkg)
+        if self.is_published(pkg_id, version):
+            print('[NuGet] {} {} is already published.'
+                  .format(pkg_id, version))
+            return 'skipped'
+
+        cmd = 'dotnet nuget push {} -k {} -s {} -t {}'.format(
+              nupkg, self.apikey, self.source, PUSH_TIMEOUT)
+        attempt = 0
+        while True:
+            try:
+                sh(cmd, cwd=cwd, secrets=[self.apikey])
+                break
+            except ShellError as err:
+                # A push may fail after the feed has got the package.
+                if self.is_published(pkg_id, version):
+                    break
+                if attempt >= self.retries:
+                    print('[NuGet] Failed to push {} {}: {}'
+                          .format(pkg_id, version, err.message))
+                    return err
+                attempt += 1
+                delay = RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                delay *= random.uniform(1, 1.5)
+                print('[NuGet] Retry to push {} {} in {:.0f}s'
+                      .format(pkg_id, version, delay))
+                time.sleep(delay)
+
+        print('[NuGet] Pushed {} {}'.format(pkg_id, version))
+        self._record(pkg_id, version)
+        return 'pushed'
+
+    def _read_record(self):
+        recorded = set()
+        if self.record_file and os.path.exists(self.record_file):
+            with open(self.record_file) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == 3 and fields[0] == self.source:
+                        recorded.add((fields[1].lower(), fields[2].lower()))
+        return recorded
+
+    def _record(self, pkg_id, version):
+        if not self.record_file:
+            return
+        with self._record_lock:
+            os.makedirs(os.path.dirname(self.record_file), exist_ok=True)
+            with open(self.record_file, 'a') as f:
+                f.write('{}\t{}\t{}\n'.format(self.source, pkg_id, version))
+            self._recorded.add((pkg_id.lower(), version.lower()))
@@ -15,8 +15,14 @@
 # limitations under the License.
 
 import os
+import shlex
 from glob import glob
-from common.shell import sh
+from xml.etree import ElementTree
+from common.shell import sh, ShellError
+from common.buildcache import BuildCache
+from common.nuget import PackagePusher
+
+SOURCE_DIR = 'src'
 
 
 class ProjectError(Exception):
@@ -37,6 +43,7 @@ class Project:
         self.workspace = None
         self.buildshell = None
         self.logfile = None
+        self.partial_build = False
         self._env = env
 
         if workspace is not None:
@@ -60,22 +67,178 @@ class Project:
         cmd = 'dotnet msbuild ./build/build.proj /nologo /t:restore'
         sh(cmd, cwd=self.workspace)
 
-    def build(self, with_analysis=True, dummy=False, pack=False):
-        args = ['full', '/flp:LogFile=%s' % self.logfile]
-        if with_analysis:
-            args.append('/p:BuildWithAnalysis=True')
-        sh(self.buildshell, args)
+    def build(self, with_analysis=True, dummy=False, pack=False,
+              base=None, changed_files=None):
+        """Builds the project, or restores its outputs from the build cache.
+
+        The cache is used only when the environment has build_cache_dir.
+
+        If the commit base and the paths changed since base are given, and
+        the outputs of base are in the cache, only the projects affected by
+        the changes are built on top of them. Such outputs are not stored in
+        the cache, since the log has only the warnings of those projects.
+        A change outside of the projects makes it a full build.
+
+        After such a build, partial_build is True: Artifacts/bin/public may
+        still have assemblies of base, so the outputs are not fit for API
+        extraction.
+        """
+        self.partial_build = False
+        cache = None
+        key = None
+        flags = {'with_analysis': with_analysis, 'dummy': dummy, 'pack': pack}
+        cache_dir = getattr(self._env, 'build_cache_dir', None)
+        if cache_dir:
+            cache = BuildCache(cache_dir, self._env.build_cache_max_size)
+            key = cache.key(self.workspace, flags)
+            if key is None:
+                print('[BuildCache] The workspace has local changes.')
+            elif cache.restore(key, self.workspace):
+                print('[BuildCache] Restored the build outputs of ' + key)
+                return
+
+        if cache is not None and base is not None \
+                and changed_files is not None:
+            modules = self._restore_base(cache, flags, base, changed_files)
+            if modules is not None:
+                self._build(with_analysis, dummy, pack, modules)
+                self.partial_build = True
+                return
+
+        self._build(with_analysis, dummy, pack)
+
+        if key is not None:
+            cache.store(key, self.workspace)
+            print('[BuildCache] Stored the build outputs as ' + key)
+
+    def project_graph(self):
+        """Returns the projects in SOURCE_DIR and the projects they refer to.
+
+        Projects are named after their directories, as build.sh does.
+        """
+        src_dir = os.path.join(self.workspace, SOURCE_DIR)
+        graph = {}
+        for csproj in glob(os.path.join(src_dir, '*', '*.csproj')):
+            name = os.path.basename(os.path.dirname(csproj))
+            refs = graph.setdefault(name, set())
+            for elem in ElementTree.parse(csproj).iter():
+                include = elem.get('Include')
+                if not elem.tag.endswith('ProjectReference') or not include:
+                    continue
+                path = os.path.normpath(os.path.join(
+                    os.path.dirname(csproj), include.replace('\\', '/')))
+                if os.path.dirname(os.path.dirname(path)) == src_dir:
+                    refs.add(os.path.basename(os.path.dirname(path)))
+        return graph
+
+    def affected_projects(self, changed_files):
+        """Returns the projects to rebuild for the changed paths.
+
+        These are the projects with a changed file and the projects that
+        refer to them, ordered so that a project comes after the projects
+        it refers to. Returns None if a path is not in any project.
+        """
+        graph = self.project_graph()
+        affected = set()
+        for path in changed_files:
+            parts = path.split('/')
+            if len(parts) < 3 or parts[0] != SOURCE_DIR \
+                    or parts[1] not in graph:
+                return None
+            affected.add(parts[1])
+
+        referrers = {}
+        for name, refs in graph.items():
+            for ref in refs:
+                referrers.setdefault(ref, set()).add(name)
+        pending = list(affected)
+        while pending:
+            for name in referrers.get(pending.pop(), ()):
+                if name not in affected:
+                    affected.add(name)
+                    pending.append(name)
+
+        ordered = []
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for ref in sorted(graph[name]):
+                if ref in graph:
+                    visit(ref)
+            if name in affected:
+                ordered.append(name)
+
+        for name in sorted(affected):
+            visit(name)
+        return ordered
+
+    def _restore_base(self, cache, flags, base, changed_files):
+        """Restores the outputs of base and returns the projects to build.
+
+        Returns None if a full build is needed instead.
+        """
+        try:
+            # The workspace may also have commits of the target branch
+            # that came after base.
+            diff = sh('git diff --name-only {} HEAD'.format(
+                      shlex.quote(base)), cwd=self.workspace,
+                      print_stdout=False, return_stdout=True)
+            base_key = cache.key(self.workspace, flags, rev=base)
+        except ShellError:
+            print('[BuildCache] {} is not found in the workspace.'
+                  .format(base))
+            return None
+
+        modules = self.affected_projects(
+            set(changed_files) | set(diff.split()))
+        if modules is None:
+            print('[BuildCache] Files outside of the projects are changed.')
+            return None
+        # Start the log of this build first, so that a reader following it
+        # never sees a previous log. The log of base is not restored.
+        if os.path.exists(self.logfile):
+            os.remove(self.logfile)
+        open(self.logfile, 'w').close()
+        if not cache.restore(base_key, self.workspace, ['Artifacts']):
+            print('[BuildCache] No build outputs of {}.'.format(base))
+            return None
+        print('[BuildCache] Restored the build outputs of {}. Build {}.'
+              .format(base, ', '.join(modules) or 'nothing'))
+        return modules
+
+    def _build(self, with_analysis, dummy, pack, modules=None):
+        if modules is None:
+            args = ['full', '/flp:LogFile=%s' % self.logfile]
+            if with_analysis:
+                args.append('/p:BuildWithAnalysis=True')
+            sh(self.buildshell, args)
+        else:
+            # The builds of the modules append to the log started by
+            # _restore_base().
+            for module in modules:
+                args = ['build', module,
+                        shlex.quote('/flp:LogFile=%s;Append' % self.logfile)]
+                if with_analysis:
+                    args.append('/p:BuildWithAnalysis=True')
+                sh(self.buildshell, args)
         if dummy:
             sh(self.buildshell, ['dummy'])
         if pack:
             sh(self.buildshell, ['pack'])
 
-    def push_nuget_packages(self, apikey, source):
-        nupkgs = glob(os.path.join(self.workspace, 'Artifacts/*.nupkg'))
-        for p in nupkgs:
-            cmd = 'dotnet nuget push {} -k {} -s {} -t 3000'.format(
-                  p, apikey, source)
-            sh(cmd, cwd=self.workspace)
+    def push_nuget_packages(self, apikey, source, **kwargs):
+        """Pushes Artifacts/*.nupkg to source.
+
+        kwargs are passed to PackagePusher, to push them in parallel and to
+        skip the packages already published.
+        """
+        nupkgs = sorted(glob(os.path.join(self.workspace,
+                                          'Artifacts/*.nupkg')))
+        pusher = PackagePusher(apikey, source, **kwargs)
+        pusher.push(nupkgs, cwd=self.workspace)
 
     def _find_workspace(self, env):
         if self._is_valid_workspace(env.workspace):
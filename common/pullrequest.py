@@ -16,11 +16,129 @@
 
 import os
 import re
-from time import sleep
-from github import Github, GithubObject, GithubException
+import asyncio
+import hashlib
+import functools
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from github import GithubObject, GithubException
 from common.buildlog import BuildLog
+from common.github_client import GithubClient
 
 DIFF_PATTERN = re.compile(r'^@@ \-([0-9,]+) \+([0-9,]+) @@')
+MAX_WARNING_COMMENTS = 50
+PUBLISH_CONCURRENCY = 4
+
+
+class FileDiff:
+    """Line to diff position map of a patch, kept in sorted arrays."""
+
+    __slots__ = ('_lines', '_positions', '_hunk_starts', '_hunk_ends')
+
+    def __init__(self, patch):
+        self._lines = array('l')
+        self._positions = array('l')
+        self._hunk_starts = array('l')
+        self._hunk_ends = array('l')
+
+        line_number = 0
+        for position, line in enumerate(patch.split("\n")):
+            m = DIFF_PATTERN.match(line)
+            if m is not None:
+                hunkrange = m.group(2).split(',')
+                if len(hunkrange) == 1:
+                    hunkrange.append(1)
+                start, length = map(int, hunkrange)
+                self._hunk_starts.append(start)
+                self._hunk_ends.append(start + length)
+                line_number = start
+                continue
+            elif line.startswith('-'):
+                continue
+            self._lines.append(line_number)
+            self._positions.append(position)
+            line_number += 1
+
+    def position(self, line_number):
+        i = bisect_left(self._lines, line_number)
+        if i == len(self._lines) or self._lines[i] != line_number:
+            raise KeyError(line_number)
+        return self._positions[i]
+
+    def in_hunk(self, line_number):
+        i = bisect_right(self._hunk_starts, line_number) - 1
+        return i >= 0 and line_number < self._hunk_ends[i]
+
+
+class PublishQueue:
+    """Sends GitHub mutations concurrently from an asyncio event loop.
+
+    Mutations submitted with the same key run in the order they were
+    submitted, e.g. the statuses of one context; the others run
+    concurrently, at most `concurrency` at a time. The blocking PyGithub
+    calls run in the default executor of a loop running in a background
+    thread. Errors are raised by flush().
+    """
+
+    def __init__(self, concurrency=PUBLISH_CONCURRENCY):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        self._semaphore = self._run_coroutine(self._new_semaphore(
+            concurrency)).result()
+        self._lock = threading.Lock()
+        self._tails = {}
+        self._futures = []
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            previous = self._tails.get(key)
+            future = self._run_coroutine(self._run(
+                previous, functools.partial(fn, *args, **kwargs)))
+            self._tails[key] = future
+            self._futures.append(future)
+        return future
+
+    def wait(self, key):
+        """Waits until the mutations submitted with the key are sent."""
+        with self._lock:
+            future = self._tails.get(key)
+        if future is not None:
+            future.exception()
+
+    def flush(self):
+        """Waits for all submitted mutations and raises the first error."""
+        with self._lock:
+            futures = self._futures
+            self._futures = []
+        errors = [f.exception() for f in futures]
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def _run_coroutine(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _new_semaphore(self, concurrency):
+        return asyncio.Semaphore(concurrency)
+
+    async def _run(self, previous, call):
+        if previous is not None:
+            # Keep the order, but do not stop on an error of the previous.
+            await asyncio.gather(asyncio.wrap_future(previous),
+                                 return_exceptions=True)
+        async with self._semaphore:
+            return await self._loop.run_in_executor(None, call)
 
 
 class PullRequest:
@@ -29,40 +147,86 @@ class PullRequest:
         self.state = env.github_pr_state
         self.target_branch = env.github_pr_target_branch
 
-        gh = Github(env.github_token)
-        repo = gh.get_repo(env.github_repo)
-        self._ghpr = repo.get_pull(self.number)
+        self._client = GithubClient(
+            env.github_token, getattr(env, 'github_etag_cache', None))
+        self._issue_path = '/repos/{}/issues/{}'.format(
+            env.github_repo, self.number)
+        self._pull_path = '/repos/{}/pulls/{}'.format(
+            env.github_repo, self.number)
+
+        gh = self._client.github
+        repo = self._client.call('get_repo', gh.get_repo, env.github_repo)
+        self._ghpr = self._client.call('get_pull', repo.get_pull, self.number)
+        self.base_commit = self._ghpr.base.sha
 
-        self.latest_commit = self._ghpr.get_commits().reversed[0]
-        self.changed_files = self._ghpr.get_files()
+        commits = self._client.get('get_commits', self._pull_path + '/commits')
+        self.latest_commit = self._client.call(
+            'get_commit', repo.get_commit, commits[-1]['sha'])
 
-        self._map_difflines()
+        self._reported_warnings = set()
+        self._warning_comment_count = 0
+        self._queued_review_comments = []
+        self._existing_comments = None
+        self._publisher = PublishQueue()
 
-    def _map_difflines(self):
-        self._line_to_position_map = {}
-        self._file_diffhunk_paris = {}
+        # Changed files and their diffs are read only when needed.
+        self._changed_files = None
+        self._file_patches = None
+        self._file_diffs = {}
+        self._path_suffix_index = None
 
+    @property
+    def changed_files(self):
+        if self._changed_files is None:
+            self._changed_files = self._client.get(
+                'get_files', self._pull_path + '/files')
+        return self._changed_files
+
+    @property
+    def changed_paths(self):
+        """Paths of the changed files, including the old paths of renames."""
+        paths = set()
         for f in self.changed_files:
-            path = f.filename
-            if f.patch is None:
-                continue
-            self._line_to_position_map[path] = {}
-            diff_lines = []
-            line_number = 0
-            for position, line in enumerate(f.patch.split("\n")):
-                m = DIFF_PATTERN.match(line)
-                if m is not None:
-                    hunkrange = m.group(2).split(',')
-                    if len(hunkrange) == 1:
-                        hunkrange.append(1)
-                    diff_lines.append(list(map(int, hunkrange)))
-                    line_number = int(hunkrange[0])
-                    continue
-                elif line[0] == '-':
+            paths.add(f['filename'])
+            if f.get('previous_filename'):
+                paths.add(f['previous_filename'])
+        return paths
+
+    def _get_file_diff(self, path):
+        """Returns the FileDiff of a changed file, or None without a patch.
+
+        The patch of each file is parsed on the first lookup of the file.
+        """
+        if self._file_patches is None:
+            self._file_patches = {f['filename']: f.get('patch')
+                                  for f in self.changed_files}
+        if path not in self._file_diffs:
+            patch = self._file_patches.get(path)
+            self._file_diffs[path] = \
+                FileDiff(patch) if patch is not None else None
+        return self._file_diffs[path]
+
+    def _find_changed_paths(self, filename):
+        if self._path_suffix_index is None:
+            # Index the paths by every suffix on a directory boundary, so
+            # that relative paths in the build log are found by a lookup.
+            self._path_suffix_index = {}
+            for f in self.changed_files:
+                if f.get('patch') is None:
                     continue
-                self._line_to_position_map[path][line_number] = position
-                line_number += 1
-            self._file_diffhunk_paris[path] = diff_lines
+                parts = f['filename'].split('/')
+                for i in range(len(parts)):
+                    self._path_suffix_index.setdefault(
+                        '/'.join(parts[i:]), []).append(f['filename'])
+
+        filename = filename.replace('\\', '/')
+        while filename.startswith('./'):
+            filename = filename[2:]
+        return self._path_suffix_index.get(filename, [])
+
+    def _in_diffhunk(self, path, line_number):
+        diff = self._get_file_diff(path)
+        return diff is not None and diff.in_hunk(line_number)
 
     def set_status(self, state,
                    target_url=GithubObject.NotSet,
@@ -70,85 +234,194 @@ class PullRequest:
                    context=GithubObject.NotSet):
         if self._ghpr.commits < 1:
             return False
-        self.latest_commit.create_status(
-            state, target_url, description, context)
+        self._publish(('status', context), 'create_status',
+                      self.latest_commit.create_status,
+                      state, target_url, description, context)
         return True
 
     def set_labels(self, *labels):
-        self._ghpr.set_labels(*labels)
+        self._publish('labels', 'set_labels', self._ghpr.set_labels,
+                      *labels, warn_on_error=True)
 
     def add_to_labels(self, *labels):
-        try:
-            self._ghpr.add_to_labels(*labels)
-        except GithubException as err:
-            print('Warning: ' + err.data['message'])
+        self._publish('labels', 'add_to_labels', self._ghpr.add_to_labels,
+                      *labels, warn_on_error=True)
 
     def remove_from_labels(self, label):
-        try:
-            self._ghpr.remove_from_labels(label)
-        except GithubException as err:
-            print('Warning: ' + err.data['message'])
+        self._publish('labels', 'remove_from_labels',
+                      self._ghpr.remove_from_labels, label,
+                      warn_on_error=True)
+
+    def reconcile_labels(self, wanted=(), unwanted=(), current=None):
+        """Brings the labels of the PR to the desired state in one request.
+
+        Labels in wanted are added and labels in unwanted are removed; any
+        other label is kept as it is. current is the list of labels when
+        the caller has already fetched them. Nothing is sent if the labels
+        are already in the desired state.
+        """
+        if current is None:
+            current = self.get_labels()
+        desired = (set(current) - set(unwanted)) | set(wanted)
+        if desired == set(current):
+            return False
+        self.set_labels(*sorted(desired))
+        return True
 
     def exists_in_labels(self, label):
-        for lb in self._ghpr.labels:
-            if lb.name == label:
-                return True
-        return False
+        return label in self.get_labels()
 
     def get_labels(self):
-        return self._ghpr.get_labels()
+        # Read the labels after the label changes being sent.
+        self._publisher.wait('labels')
+        labels = self._client.get('get_labels', self._issue_path + '/labels')
+        return [lb['name'] for lb in labels]
 
     def create_review_comment(self, path, line_number, body):
-        position = self._line_to_position_map[path][line_number]
-        for c in self._ghpr.get_comments():
-            if c.path == path and c.position == position and c.body == body:
-                return False
+        position = self._get_file_diff(path).position(line_number)
+        key = _comment_key(path, position, body)
+        if key in self._get_existing_comments():
+            return False
         if self._ghpr.commits < 1:
             return False
-        self._ghpr.create_review_comment(
-            body, self.latest_commit, path, position)
+        self._publish('review', 'create_review_comment',
+                      self._ghpr.create_review_comment,
+                      body, self.latest_commit, path, position)
+        self._existing_comments.add(key)
         return True
 
+    def queue_review_comment(self, path, line_number, body):
+        """Queues a review comment to be sent by submit_review_comments()."""
+        position = self._get_file_diff(path).position(line_number)
+        self._queued_review_comments.append(
+            {'path': path, 'position': position, 'body': body})
+
+    def submit_review_comments(self):
+        """Sends all queued review comments as a single review."""
+        queued = self._queued_review_comments
+        self._queued_review_comments = []
+        if not queued or self._ghpr.commits < 1:
+            return False
+        existing = self._get_existing_comments()
+        comments = []
+        keys = set()
+        for c in queued:
+            key = _comment_key(c['path'], c['position'], c['body'])
+            if key not in existing and key not in keys:
+                keys.add(key)
+                comments.append(c)
+        if not comments:
+            return False
+        # A review with the COMMENT event requires a body.
+        body = '### Build Warning:\n> {} warning{} in the changes.'.format(
+            len(comments), '' if len(comments) == 1 else 's')
+        self._publish('review', 'create_review', self._ghpr.create_review,
+                      self.latest_commit, body=body, event='COMMENT',
+                      comments=comments)
+        existing.update(keys)
+        return True
+
+    def _get_existing_comments(self):
+        """Returns keys of the review comments on the PR.
+
+        The comments are fetched once per run; comments made by this
+        object are added to the set as they are posted.
+        """
+        if self._existing_comments is None:
+            comments = self._client.get(
+                'get_comments', self._pull_path + '/comments')
+            self._existing_comments = set(
+                _comment_key(c['path'], c['position'], c['body'])
+                for c in comments)
+        return self._existing_comments
+
     def create_issue_comment(self, body):
-        self._ghpr.create_issue_comment(body)
+        self._publish('issue_comment', 'create_issue_comment',
+                      self._ghpr.create_issue_comment, body)
+
+    def flush(self):
+        """Waits until all status, label and comment changes are sent."""
+        self._publisher.flush()
+
+    def close(self):
+        """Sends pending changes, prints the API usage and saves ETags."""
+        try:
+            self._publisher.close()
+        finally:
+            self._client.print_stats()
+            self._client.close()
 
-    def report_warnings_as_review_comment(self, logfile):
+    def _publish(self, key, name, fn, *args, warn_on_error=False, **kwargs):
+        def call():
+            try:
+                return self._client.call(name, fn, *args, mutation=True,
+                                         **kwargs)
+            except GithubException as err:
+                if not warn_on_error:
+                    raise
+                print('Warning: ' + err.data['message'])
+        self._publisher.submit(key, call)
+
+    def report_warnings_as_review_comment(self, logfile, build_log=None):
+        """Comments the warnings in the log, which may be given already
+        parsed as build_log.
+        """
         if not os.path.exists(logfile):
             return
+        if build_log is None:
+            build_log = BuildLog(logfile)
 
-        build_log = BuildLog(logfile)
-        count = 0
+        summary = build_log.warning_summary()
+        for code in sorted(summary, key=lambda c: -summary[c]['count']):
+            print('[BuildLog] {}: {} warnings ({} unique in {} files)'.format(
+                code, summary[code]['count'], summary[code]['unique'],
+                summary[code]['files']))
 
-        for f in self.changed_files:
-            path = f.filename
-            if f.patch is None:
+        for warn in build_log.unique_warnings:
+            if not self.report_warning_as_review_comment(warn):
+                break
+        self.submit_review_comments()
+
+    def report_warning_as_review_comment(self, warn):
+        """Queues a comment of a warning on the changed line it belongs to.
+
+        The same warning is queued only once. Returns False when too many
+        comments have been queued, so that callers stop reporting. Queued
+        comments are sent by submit_review_comments().
+        """
+        key = (warn['file'], warn['line'], warn['code'], warn['message'])
+        if key in self._reported_warnings:
+            return True
+        self._reported_warnings.add(key)
+
+        wline = warn['line']
+        for path in self._find_changed_paths(warn['file']):
+            if not self._in_diffhunk(path, wline):
                 continue
+            if self._warning_comment_count > MAX_WARNING_COMMENTS:
+                return False
+            body = 'warning {}: {}'.format(warn['code'], warn['message'])
+            self.queue_review_comment(path, wline, body)
+            self._warning_comment_count += 1
+            if self._warning_comment_count > MAX_WARNING_COMMENTS:
+                print('Too many comments! Skip the rest!')
+                return False
+        return True
 
-            for line in self._file_diffhunk_paris[path]:
-                for warn in build_log.warnings:
-                    if not path.endswith(warn['file']):
-                        continue
-                    wcode = warn['code']
-                    wline = warn['line']
-                    wmsg = warn['message']
-                    if line[0] <= wline and wline < (line[0] + line[1]):
-                        body = 'warning {}: {}'.format(wcode, wmsg)
-                        self.create_review_comment(path, wline, body)
-                        count += 1
-                        if count > 50:
-                            print('Too many comments! Skip the rest!')
-                            return
-                        sleep(0.5)
-
-    def report_errors_as_issue_comment(self, logfile):
+    def report_errors_as_issue_comment(self, logfile, build_log=None):
         if not os.path.exists(logfile):
             return
-        bl = BuildLog(logfile)
+        if build_log is None:
+            build_log = BuildLog(logfile)
 
-        if len(bl.errors) < 1:
+        if len(build_log.unique_errors) < 1:
             return
         body = '### Build Error:\n'
-        for err in bl.errors:
+        for err in build_log.unique_errors:
             body += '> {}({}): {}: {}\n' \
                 .format(err['file'], err['line'], err['code'], err['message'])
         self.create_issue_comment(body)
+
+
+def _comment_key(path, position, body):
+    return (path, position, hashlib.sha1(body.encode('utf-8')).hexdigest())
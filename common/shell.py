@@ -16,7 +16,23 @@
 
 import os
 import sys
-from subprocess import Popen, PIPE
+import json
+import time
+import uuid
+import shlex
+import atexit
+import threading
+from collections import deque
+from subprocess import Popen, PIPE, STDOUT
+
+STDERR_TAIL_LINES = 200
+
+# Environment variable naming a file to append a JSON line per command to
+TRACE_FILE_ENV = 'SHELL_TRACE_FILE'
+
+# Trace file of a Jenkins run when TRACE_FILE_ENV is not set. It is kept in
+# the temporary directory of the workspace, out of the git tree.
+TRACE_FILE_DEFAULT = '{WORKSPACE}@tmp/shell-trace-{BUILD_TAG}.jsonl'
 
 
 class ShellError(Exception):
@@ -27,34 +43,255 @@ class ShellError(Exception):
 
 
 def sh(cmd, args=(), cwd=None,
-       print_stdout=True, return_status=False, return_stdout=False):
+       print_stdout=True, return_status=False, return_stdout=False,
+       secrets=()):
+    """Runs cmd with args in a shell.
+
+    The values in secrets, such as API keys in cmd, are masked in what is
+    printed, traced or raised.
+    """
 
     cmdml = cmd.split('\n')
     if (len(cmdml) > 1):
+        # The lines share one shell, which also keeps variables set by
+        # earlier scripts in this directory.
+        session = ShellSession.for_workspace(cwd)
+        session.reset()
         for cmdsl in cmdml:
             if len(cmdsl.strip()) > 0:
-                sh(cmdsl, args, cwd, print_stdout)
+                session.run('{} {}'.format(cmdsl.strip(), ' '.join(args)),
+                            print_stdout, secrets=secrets)
         return
 
     cmd = '{} {}'.format(cmd.strip(), ' '.join(args))
-    ret = ''
     if print_stdout:
-        print('[shell] ' + cmd)
+        print('[shell] ' + _redact(cmd, secrets))
+    started = time.time()
     pobj = Popen(cmd, cwd=cwd, shell=True, stdout=PIPE,
                  stderr=PIPE, universal_newlines=True)
-    while True:
-        output = pobj.stdout.readline()
-        ret += output
-        if output == '' and pobj.poll() is not None:
-            break
-        if output and print_stdout:
+
+    # Drain stderr in another thread so that a chatty process never blocks
+    # on a full pipe. Only its tail is kept for the error message.
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_size = [0]
+    stderr_thread = threading.Thread(
+        target=_drain, args=(pobj.stderr, stderr_tail, stderr_size),
+        daemon=True)
+    stderr_thread.start()
+
+    stdout_lines = [] if return_stdout else None
+    stdout_size = 0
+    for output in pobj.stdout:
+        stdout_size += len(output)
+        if stdout_lines is not None:
+            stdout_lines.append(output)
+        if print_stdout:
             print(output.strip())
-    rc = pobj.poll()
+    stderr_thread.join()
+    rc, rusage = _wait(pobj)
+    pobj.stdout.close()
+    pobj.stderr.close()
+
+    _trace(_redact(cmd, secrets), cwd, started, rc,
+           stdout_size + stderr_size[0], user=rusage.ru_utime,
+           sys=rusage.ru_stime, maxrss_kb=rusage.ru_maxrss)
+
     if return_status:
         return rc
     else:
         if rc:
-            raise ShellError("Error running %s, error : %s" %
-                             (cmd, pobj.stderr.read()))
+            raise ShellError(_redact("Error running %s, error : %s" %
+                                     (cmd, ''.join(stderr_tail)), secrets))
     if return_stdout:
-        return ret
+        return ''.join(stdout_lines)
+
+
+def _redact(text, secrets):
+    for secret in secrets:
+        if secret:
+            text = text.replace(secret, '********')
+    return text
+
+
+def _drain(stream, tail, size):
+    for line in stream:
+        tail.append(line)
+        size[0] += len(line)
+
+
+def _wait(pobj):
+    """Waits for the process and returns its exit code and resource usage.
+
+    The usage includes the children the process waited for, so it covers
+    the whole command run by the shell.
+    """
+    _, status, rusage = os.wait4(pobj.pid, 0)
+    if os.WIFSIGNALED(status):
+        pobj.returncode = -os.WTERMSIG(status)
+    else:
+        pobj.returncode = os.WEXITSTATUS(status)
+    return pobj.returncode, rusage
+
+
+_trace_lock = threading.Lock()
+
+
+def _trace(cmd, cwd, started, rc, output_size, **usage):
+    """Appends a record of the command to the trace file, if any."""
+    path = _trace_file()
+    if not path:
+        return
+    record = {'cmd': cmd, 'cwd': os.path.abspath(cwd or os.getcwd()),
+              'start': round(started, 3),
+              'wall': round(time.time() - started, 3),
+              'rc': rc, 'output_size': output_size}
+    for key, value in usage.items():
+        record[key] = round(value, 3) if isinstance(value, float) else value
+    with _trace_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def _trace_file():
+    path = os.environ.get(TRACE_FILE_ENV)
+    if path is not None:
+        return os.path.abspath(path) if path else None
+    if 'WORKSPACE' not in os.environ:
+        return None
+    return TRACE_FILE_DEFAULT.format(
+        WORKSPACE=os.environ['WORKSPACE'].rstrip('/'),
+        BUILD_TAG=os.environ.get('BUILD_TAG', os.getpid()))
+
+
+class ShellSession:
+    """A /bin/sh process kept alive to run the lines of a script.
+
+    Each command is followed by an echo of a unique sentinel and its exit
+    code, which gives the output and status of every command without
+    spawning a new shell. The shell state, such as the current directory
+    and variables, carries over from one command to the next. stderr of
+    the commands is merged into the output.
+
+    The session is shared by the scripts run in the same directory, and
+    reset() restores only the current directory. Variables, functions and
+    shell options set by a script are still set in the next script.
+    """
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    @classmethod
+    def for_workspace(cls, cwd=None):
+        """Returns the live session of the directory, starting it if needed."""
+        cwd = os.path.abspath(cwd or os.getcwd())
+        with cls._sessions_lock:
+            session = cls._sessions.get(cwd)
+            if session is None or not session.alive:
+                session = cls(cwd)
+                cls._sessions[cwd] = session
+            return session
+
+    @classmethod
+    def close_all(cls):
+        with cls._sessions_lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self._lock = threading.Lock()
+        self._proc = Popen('/bin/sh', cwd=cwd, shell=False, stdin=PIPE,
+                           stdout=PIPE, stderr=STDOUT,
+                           universal_newlines=True, bufsize=1)
+
+    @property
+    def alive(self):
+        return self._proc.poll() is None
+
+    def reset(self):
+        """Goes back to the directory where the session started.
+
+        Other shell state is kept.
+        """
+        self.run('cd ' + shlex.quote(self.cwd), print_stdout=False)
+
+    def run(self, cmd, print_stdout=True, return_status=False, secrets=()):
+        if print_stdout:
+            print('[shell] ' + _redact(cmd, secrets))
+        with self._lock:
+            if not self.alive:
+                raise ShellError(_redact(
+                    "Error running %s, error : shell exited" % cmd, secrets))
+            started = time.time()
+            cpu_before = self._cpu_times()
+            rc, output, output_size = self._run(cmd, print_stdout)
+            cpu_after = self._cpu_times()
+        # The shell outlives its commands, so there is no rusage of them.
+        # CPU times are the growth of those of the shell and its children,
+        # and the peak RSS is unknown.
+        usage = {'session': True, 'maxrss_kb': None}
+        if cpu_before is not None and cpu_after is not None:
+            usage['user'] = cpu_after[0] - cpu_before[0]
+            usage['sys'] = cpu_after[1] - cpu_before[1]
+        _trace(_redact(cmd, secrets), self.cwd, started, rc, output_size,
+               **usage)
+        if return_status:
+            return rc
+        if rc:
+            raise ShellError(_redact("Error running %s, error : %s" %
+                                     (cmd, ''.join(output)), secrets))
+
+    def _cpu_times(self):
+        """Returns the user and system CPU times of the shell, including
+        the children it waited for, or None without /proc.
+        """
+        try:
+            with open('/proc/{}/stat'.format(self._proc.pid)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            return None
+        # utime, stime, cutime and cstime are the fields 14 to 17.
+        utime, stime, cutime, cstime = (int(v) for v in fields[11:15])
+        ticks = os.sysconf('SC_CLK_TCK')
+        return (utime + cutime) / ticks, (stime + cstime) / ticks
+
+    def close(self):
+        if self.alive:
+            self._proc.stdin.write('exit\n')
+            self._proc.stdin.close()
+        self._proc.wait()
+        self._proc.stdout.close()
+
+    def _run(self, cmd, print_stdout):
+        sentinel = '__SHELL_SESSION_{}__'.format(uuid.uuid4().hex)
+        # The command is quoted for eval, so that an unbalanced quote or an
+        # unterminated here-document fails on its own instead of swallowing
+        # the sentinel. Commands read no stdin, which carries the next
+        # commands.
+        self._proc.stdin.write('{ eval %s\n} </dev/null\necho "%s $?"\n'
+                               % (shlex.quote(cmd), sentinel))
+        self._proc.stdin.flush()
+
+        output = deque(maxlen=STDERR_TAIL_LINES)
+        output_size = 0
+        for line in self._proc.stdout:
+            index = line.find(sentinel)
+            if index >= 0:
+                if index > 0:
+                    output.append(line[:index])
+                    output_size += index
+                    if print_stdout:
+                        print(line[:index])
+                return (int(line[index + len(sentinel):]), output,
+                        output_size)
+            output.append(line)
+            output_size += len(line)
+            if print_stdout:
+                print(line.strip())
+        # The command made the shell exit.
+        return self._proc.wait(), output, output_size
+
+
+atexit.register(ShellSession.close_all)
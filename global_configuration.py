@@ -39,3 +39,41 @@ GERRIT_GIT_URL = ('ssh://dotnetbuild@review.tizen.org:29418/'
                   'platform/core/csapi/tizenfx')
 
 MYGET_PUSH_FEED = 'https://tizen.myget.org/F/dotnet/api/v2/package'
+
+# Flat container (NuGet v3) of the feed, to find the published packages
+MYGET_FLATCONTAINER_URL = ('https://tizen.myget.org/F/dotnet/api/v3/'
+                           'flatcontainer')
+
+# Number of packages to push at the same time, and retries of a push
+NUGET_PUSH_WORKERS = 4
+NUGET_PUSH_RETRIES = 3
+
+# File on the build agent to record the packages pushed to the feeds
+NUGET_PUSH_RECORD = '~/.cache/tizenfx-jenkins/nuget-pushed.tsv'
+
+# Storage of APIDB: 'dynamodb' or 'sqlite'
+APIDB_BACKEND = 'dynamodb'
+
+# Database file of APIDB when APIDB_BACKEND is 'sqlite'
+APIDB_SQLITE_PATH = '~/.cache/tizenfx-jenkins/apidb.sqlite3'
+
+# Number of categories to import to APIDB at the same time
+APIDB_IMPORT_WORKERS = 3
+
+# Directory on the build agent to keep snapshots of APIDB categories
+APIDB_CACHE_DIR = '~/.cache/tizenfx-jenkins/apidb'
+
+# Directory on the build agent to keep APIs extracted from each assembly
+APITOOL_CACHE_DIR = '~/.cache/tizenfx-jenkins/apitool'
+
+# Number of APITool processes to run in parallel
+APITOOL_WORKERS = 4
+
+# File on the build agent to keep ETags and responses of GitHub API reads
+GITHUB_ETAG_CACHE = '~/.cache/tizenfx-jenkins/github-etags.json'
+
+# Directory on the build agent to keep the outputs of builds
+BUILD_CACHE_DIR = '~/.cache/tizenfx-jenkins/build'
+
+# Total size in bytes of the build outputs to keep
+BUILD_CACHE_MAX_SIZE = 20 * 1024 * 1024 * 1024
@@ -19,9 +19,10 @@
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from common.project import Project, ProjectError, ProjectNotFoundException
 from common.shell import ShellError
-from common.apidb import APIDB
+from common.apidb import APIDB, APIDBError
 from common import apitool
 import global_configuration as conf
 
@@ -29,6 +30,10 @@ import global_configuration as conf
 def main():
     env = BuildEnvironment(os.environ)
 
+    if env.refresh_targets:
+        refresh_categories(env)
+        return
+
     if env.github_branch_name not in conf.BRANCH_API_LEVEL_MAP.keys():
         print('{} branch is not a managed branch.\n'
               .format(env.github_branch_name))
@@ -40,7 +45,8 @@ def main():
 
     # Extract API from the project
     apijson_file = os.path.join(proj.workspace, 'Artifacts/build.api.json')
-    apitool.extract(proj, apijson_file)
+    apitool.extract(proj, apijson_file,
+                    env.apitool_cache_dir, env.apitool_workers)
 
     # Update APIDB
     category = conf.BRANCH_API_LEVEL_MAP[env.github_branch_name]
@@ -48,6 +54,58 @@ def main():
     db.import_datafile(category, apijson_file)
 
 
+def refresh_categories(env):
+    """Updates the categories of several branches in one run.
+
+    Each target is a (branch, workspace) pair. The workspaces are built and
+    extracted one after another, sharing the APITool cache, and then the
+    categories are imported concurrently.
+    """
+    jobs = []
+    for branch, workspace in env.refresh_targets:
+        if branch not in conf.BRANCH_API_LEVEL_MAP.keys():
+            print('{} branch is not a managed branch. Skip it.'.format(branch))
+            continue
+        category = conf.BRANCH_API_LEVEL_MAP[branch]
+        if category in [c for c, _ in jobs]:
+            print('{} is already updated by another branch. Skip {}.'
+                  .format(category, branch))
+            continue
+
+        proj = Project(env, workspace)
+        proj.build()
+        apijson_file = os.path.join(proj.workspace,
+                                    'Artifacts/build.api.json')
+        apitool.extract(proj, apijson_file,
+                        env.apitool_cache_dir, env.apitool_workers)
+        jobs.append((category, apijson_file))
+
+    def run(job):
+        category, apijson_file = job
+        # Keep any error of a category for the summary, so that the other
+        # categories are still imported and reported.
+        try:
+            return APIDB(env).import_datafile(category, apijson_file)
+        except Exception as err:
+            return err
+
+    with ThreadPoolExecutor(max_workers=env.apidb_import_workers) as executor:
+        results = list(executor.map(run, jobs))
+
+    print('[APIDB] Summary')
+    failed = []
+    for (category, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            message = getattr(result, 'message', None) or \
+                '{}: {}'.format(type(result).__name__, result)
+            print('  {}: FAILED ({})'.format(category, message))
+            failed.append(category)
+        else:
+            print('  {}: PUT: {}, DELETE: {}'.format(category, *result))
+    if failed:
+        raise APIDBError('Failed to update ' + ', '.join(failed))
+
+
 class NotValidEnvironmentException(Exception):
     """Raised when there are no requried environment variables."""
     pass
@@ -57,14 +115,49 @@ class BuildEnvironment:
 
     def __init__(self, env):
         try:
-            self.github_branch_name = env['GITHUB_BRANCH_NAME']
+            self.refresh_targets = parse_refresh_targets(
+                env.get('APIDB_REFRESH_TARGETS', ''))
+            if self.refresh_targets:
+                self.github_branch_name = env.get('GITHUB_BRANCH_NAME')
+            else:
+                self.github_branch_name = env['GITHUB_BRANCH_NAME']
             self.workspace = env['WORKSPACE']
-            self.aws_access_key_id = env['AWS_ACCESS_KEY_ID']
-            self.aws_secret_access_key = env['AWS_SECRET_ACCESS_KEY']
+            self.apidb_backend = env.get('APIDB_BACKEND', conf.APIDB_BACKEND)
+            if self.apidb_backend == 'dynamodb':
+                self.aws_access_key_id = env['AWS_ACCESS_KEY_ID']
+                self.aws_secret_access_key = env['AWS_SECRET_ACCESS_KEY']
+            self.apidb_sqlite_path = env.get('APIDB_SQLITE_PATH',
+                                             conf.APIDB_SQLITE_PATH)
+            self.apidb_endpoint_url = env.get('APIDB_ENDPOINT_URL')
+            self.apidb_cache_dir = env.get('APIDB_CACHE_DIR',
+                                           conf.APIDB_CACHE_DIR)
+            self.apitool_cache_dir = env.get('APITOOL_CACHE_DIR',
+                                             conf.APITOOL_CACHE_DIR)
+            self.apitool_workers = int(env.get('APITOOL_WORKERS',
+                                               conf.APITOOL_WORKERS))
+            self.build_cache_dir = env.get('BUILD_CACHE_DIR',
+                                           conf.BUILD_CACHE_DIR)
+            self.build_cache_max_size = int(env.get(
+                'BUILD_CACHE_MAX_SIZE', conf.BUILD_CACHE_MAX_SIZE))
+            self.apidb_import_workers = int(env.get(
+                'APIDB_IMPORT_WORKERS', conf.APIDB_IMPORT_WORKERS))
         except KeyError:
             raise NotValidEnvironmentException()
 
 
+def parse_refresh_targets(value):
+    """Parses "branch=workspace" pairs separated by spaces or commas."""
+    targets = []
+    for pair in re.split(r'[\s,]+', value.strip()):
+        if not pair:
+            continue
+        branch, sep, workspace = pair.partition('=')
+        if not sep or not branch or not workspace:
+            raise NotValidEnvironmentException()
+        targets.append((branch, workspace))
+    return targets
+
+
 if __name__ == "__main__":
     try:
         main()
@@ -81,3 +174,6 @@ if __name__ == "__main__":
     except ShellError as err:
         sys.stderr.write("Error: " + err.message + '\n')
         sys.exit(1)
+    except APIDBError as err:
+        sys.stderr.write("Error: " + err.message + '\n')
+        sys.exit(1)
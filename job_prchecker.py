@@ -20,11 +20,13 @@ import os
 import re
 import sys
 import difflib
+import threading
+from github import GithubException
 from common.pullrequest import PullRequest
 from common.project import Project, ProjectError, ProjectNotFoundException
 from common.buildlog import BuildLog
 from common.shell import ShellError
-from common.apidb import APIDB
+from common.apidb import APIDB, APIDBError
 from common import apitool
 import global_configuration as conf
 
@@ -40,13 +42,28 @@ def main():
     pr = PullRequest(env)
     proj = Project(env)
 
+    try:
+        run_checkers(pr, proj, env)
+    except BaseException:
+        # Do not let an error of sending changes hide the error of a
+        # checker, which is reported by the handlers below.
+        try:
+            pr.close()
+        except Exception as err:
+            print('Warning: Failed to update the pull request: {}'
+                  .format(err))
+        raise
+    pr.close()
+
+
+def run_checkers(pr, proj, env):
     if pr.target_branch not in conf.BRANCH_API_LEVEL_MAP.keys():
         print('{} branch is not a managed branch.\n'
               .format(pr.target_branch))
         return
 
     # Step 1: Set a label for API level detection to the pull request.
-    pr.add_to_labels(conf.BRANCH_API_LEVEL_MAP[pr.target_branch])
+    pr.reconcile_labels(wanted=[conf.BRANCH_API_LEVEL_MAP[pr.target_branch]])
 
     # Step 2: Set pending status to all checkers.
     set_pending_to_all_checkers(pr, env)
@@ -66,15 +83,42 @@ def set_pending_to_all_checkers(pr, env):
 
 
 def run_build_checker(pr, proj, env):
+    build_log = BuildLog(proj.logfile)
+    failed = False
     try:
-        proj.build()
+        # Do not follow the log of a previous build.
+        if os.path.exists(proj.logfile):
+            os.remove(proj.logfile)
+
+        # The PR's base and changed files are not passed for an incremental
+        # build: the API checker needs the assemblies of a full build, and
+        # it is not known that "build.sh build <module>" puts them in
+        # Artifacts/bin/public.
+        build = BuildThread(proj)
+        build.start()
+
+        # Report warnings and errors while the build is still running.
+        comment_warnings = True
+        for item in build_log.follow(build.is_alive):
+            if item['type'] == 'error' and not failed:
+                pr.set_status('failure', description='Build failed.',
+                              context=CTX_CHK_BUILD, target_url=env.build_url)
+                failed = True
+            elif item['type'] == 'warning' and comment_warnings:
+                comment_warnings = pr.report_warning_as_review_comment(item)
+        build.join()
+        if build.error is not None:
+            raise build.error
+
         pr.set_status('success', description='Build finished.',
                       context=CTX_CHK_BUILD, target_url=env.build_url)
-        pr.report_warnings_as_review_comment(proj.logfile)
+        pr.report_warnings_as_review_comment(proj.logfile, build_log)
     except ShellError:
-        pr.set_status('failure', description='Build failed.',
-                      context=CTX_CHK_BUILD, target_url=env.build_url)
-        pr.report_errors_as_issue_comment(proj.logfile)
+        if not failed:
+            pr.set_status('failure', description='Build failed.',
+                          context=CTX_CHK_BUILD, target_url=env.build_url)
+        pr.submit_review_comments()
+        pr.report_errors_as_issue_comment(proj.logfile, build_log)
         raise
     except:
         pr.set_status('error', description='System error.',
@@ -82,6 +126,22 @@ def run_build_checker(pr, proj, env):
         raise
 
 
+class BuildThread(threading.Thread):
+    """Runs proj.build() in the background and keeps its error."""
+
+    def __init__(self, proj, **kwargs):
+        super().__init__(daemon=True)
+        self.error = None
+        self._proj = proj
+        self._kwargs = kwargs
+
+    def run(self):
+        try:
+            self._proj.build(**self._kwargs)
+        except BaseException as err:
+            self.error = err
+
+
 def run_api_checker(pr, proj, env):
     pr.set_status('pending', description='API check started.',
                   context=CTX_CHK_API, target_url=env.build_url)
@@ -91,21 +151,26 @@ def run_api_checker(pr, proj, env):
         apijson_file = os.path.join(proj.workspace, 'Artifacts/build.api.json')
 
         # extract API
-        apitool.extract(proj, apijson_file)
+        apitool.extract(proj, apijson_file,
+                        env.apitool_cache_dir, env.apitool_workers)
 
         # compare API with APIDB
         comp = APIDB(env).compare(category, apijson_file)
 
         # set labels
+        labels = pr.get_labels()
+        wanted = [category]
+        unwanted = []
         if comp.internal_api_changed:
-            pr.add_to_labels(LABEL_INTERNAL_API_CHANGED)
+            wanted.append(LABEL_INTERNAL_API_CHANGED)
         else:
-            pr.remove_from_labels(LABEL_INTERNAL_API_CHANGED)
+            unwanted.append(LABEL_INTERNAL_API_CHANGED)
         if comp.public_api_changed:
-            if not pr.exists_in_labels(LABEL_ACR_ACCEPTED):
-                pr.add_to_labels(LABEL_ACR_REQUIRED)
+            if LABEL_ACR_ACCEPTED not in labels:
+                wanted.append(LABEL_ACR_REQUIRED)
         else:
-            pr.remove_from_labels(LABEL_ACR_REQUIRED)
+            unwanted.append(LABEL_ACR_REQUIRED)
+        pr.reconcile_labels(wanted, unwanted, current=labels)
 
         if comp.total_changed_count > 0:
             # TODO: if public api is changed, go to acr process
@@ -210,9 +275,26 @@ class BuildEnvironment:
             self.github_pr_state = env['GITHUB_PR_STATE']
             self.github_pr_target_branch = env['GITHUB_PR_TARGET_BRANCH']
             self.build_url = env['BUILD_URL']
+            self.github_etag_cache = env.get('GITHUB_ETAG_CACHE',
+                                             conf.GITHUB_ETAG_CACHE)
             self.workspace = env['WORKSPACE']
-            self.aws_access_key_id = env['AWS_ACCESS_KEY_ID']
-            self.aws_secret_access_key = env['AWS_SECRET_ACCESS_KEY']
+            self.apidb_backend = env.get('APIDB_BACKEND', conf.APIDB_BACKEND)
+            if self.apidb_backend == 'dynamodb':
+                self.aws_access_key_id = env['AWS_ACCESS_KEY_ID']
+                self.aws_secret_access_key = env['AWS_SECRET_ACCESS_KEY']
+            self.apidb_sqlite_path = env.get('APIDB_SQLITE_PATH',
+                                             conf.APIDB_SQLITE_PATH)
+            self.apidb_endpoint_url = env.get('APIDB_ENDPOINT_URL')
+            self.apidb_cache_dir = env.get('APIDB_CACHE_DIR',
+                                           conf.APIDB_CACHE_DIR)
+            self.apitool_cache_dir = env.get('APITOOL_CACHE_DIR',
+                                             conf.APITOOL_CACHE_DIR)
+            self.apitool_workers = int(env.get('APITOOL_WORKERS',
+                                               conf.APITOOL_WORKERS))
+            self.build_cache_dir = env.get('BUILD_CACHE_DIR',
+                                           conf.BUILD_CACHE_DIR)
+            self.build_cache_max_size = int(env.get(
+                'BUILD_CACHE_MAX_SIZE', conf.BUILD_CACHE_MAX_SIZE))
         except KeyError:
             raise NotValidEnvironmentException()
 
@@ -233,3 +315,10 @@ if __name__ == "__main__":
     except ShellError as err:
         sys.stderr.write("Error: " + err.message + '\n')
         sys.exit(1)
+    except APIDBError as err:
+        sys.stderr.write("Error: " + err.message + '\n')
+        sys.exit(1)
+    except GithubException as err:
+        sys.stderr.write("Error: Failed to update the pull request: {}\n"
+                         .format(err))
+        sys.exit(1)
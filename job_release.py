@@ -25,6 +25,7 @@ from datetime import datetime, timezone, timedelta
 import global_configuration as conf
 from common.project import Project, ProjectError, ProjectNotFoundException
 from common.shell import ShellError, sh
+from common.nuget import PushError
 
 
 def main():
@@ -41,7 +42,11 @@ def main():
 
     # 3. Push to MyGet
     if not env.skip_push_to_myget:
-        proj.push_nuget_packages(env.myget_apikey, conf.MYGET_PUSH_FEED)
+        proj.push_nuget_packages(env.myget_apikey, conf.MYGET_PUSH_FEED,
+                                 workers=env.nuget_push_workers,
+                                 retries=env.nuget_push_retries,
+                                 flat_url=conf.MYGET_FLATCONTAINER_URL,
+                                 record_file=env.nuget_push_record)
 
     # 4. Sync to Tizen Git Repository
     if not env.skip_push_to_tizen:
@@ -110,6 +115,12 @@ class BuildEnvironment:
             self.skip_push_to_myget = env['SKIP_PUSH_TO_MYGET'] == 'true'
             self.skip_push_to_tizen = env['SKIP_PUSH_TO_TIZEN'] == 'true'
             self.skip_submit_request = env['SKIP_SUBMIT_REQUEST'] == 'true'
+            self.nuget_push_workers = int(env.get('NUGET_PUSH_WORKERS',
+                                                  conf.NUGET_PUSH_WORKERS))
+            self.nuget_push_retries = int(env.get('NUGET_PUSH_RETRIES',
+                                                  conf.NUGET_PUSH_RETRIES))
+            self.nuget_push_record = env.get('NUGET_PUSH_RECORD',
+                                             conf.NUGET_PUSH_RECORD)
             self.version = str()
             self.category = conf.BRANCH_API_LEVEL_MAP[self.github_branch_name]
             self.gerrit_branch_name = conf.GERRIT_BRANCH_MAP[self.category]
@@ -133,3 +144,6 @@ if __name__ == "__main__":
     except ShellError as err:
         sys.stderr.write("Error: " + err.message + '\n')
         sys.exit(1)
+    except PushError as err:
+        sys.stderr.write("Error: " + err.message + '\n')
+        sys.exit(1)